@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+from hashlib import sha1
+import numpy as np
+from shared_json import update_json
+
+ANALYSIS_CACHE_FILE = 'analysis_cache.json'
+# Bump when the keyword/summary extraction changes so stale results are ignored
+NLP_VERSION = 'newspaper-nlp-1'
+
+def normalize_body(body):
+    return ' '.join(body.lower().split())
+
+class AnalysisCache:
+    """Sentiment and keyword/summary results memoized by article content.
+
+    Entries are keyed by a hash of the analyzer version and the normalized
+    body, so reposts and url variants of the same story are analyzed once,
+    and changing an analyzer invalidates only its own results.
+    """
+
+    def __init__(self, cache_file=ANALYSIS_CACHE_FILE):
+        self.cache_file = cache_file
+        self.new_entries = {}
+        self.load_cache()
+
+    def load_cache(self):
+        if os.path.exists(self.cache_file):
+            with open(self.cache_file, 'r') as f:
+                self.cache = json.load(f)
+        else:
+            self.cache = {}
+
+    def save_cache(self):
+        if not self.new_entries:
+            return
+        logging.info(f'Saving {len(self.new_entries)} new analysis results')
+        self.cache = update_json(self.cache_file, lambda cache: cache.update(self.new_entries), {})
+        self.new_entries = {}
+
+    @staticmethod
+    def key(version, body):
+        return sha1(f'{version}\n{normalize_body(body)}'.encode()).hexdigest()
+
+    def get(self, version, body):
+        key = self.key(version, body)
+        return self.new_entries.get(key, self.cache.get(key))
+
+    def put(self, version, body, result):
+        self.new_entries[self.key(version, body)] = result
+
+def classify_sentiment(polarity):
+    if polarity > 0:
+        return 'positive'
+    elif polarity == 0:
+        return 'neutral'
+    else:
+        return 'negative'
+
+class TextBlobSentiment:
+    """TextBlob's pattern analyzer on the full body, the reference backend."""
+    version = 'textblob-1'
+
+    def score(self, bodies, clean_bodies=None):
+        from textblob import TextBlob
+
+        return [TextBlob(body).sentiment.polarity for body in bodies]
+
+class LexiconSentiment:
+    """Mean lexicon polarity of the stemmed ``clean_body`` tokens, scored for a whole batch at once.
+
+    Uses TextBlob's lexicon without its negation and intensifier rules, so
+    scores are close to but not identical with TextBlobSentiment.
+    """
+    version = 'lexicon-1'
+
+    def __init__(self):
+        self.vectorizer = None
+        self.polarity = None
+
+    def load_lexicon(self):
+        from nltk.stem import SnowballStemmer
+        from sklearn.feature_extraction.text import CountVectorizer
+        from textblob.en import sentiment as pattern_sentiment
+
+        pattern_sentiment.load()
+        stemmer = SnowballStemmer(language='english')
+        polarities = {}
+        for word, senses in pattern_sentiment.items():
+            polarity = np.mean([values[0] for values in senses.values()])
+            if polarity and ' ' not in word:
+                polarities.setdefault(stemmer.stem(word.lower()), []).append(polarity)
+        vocabulary = sorted(polarities)
+        self.vectorizer = CountVectorizer(vocabulary=vocabulary, token_pattern=r'\S+', lowercase=False)
+        self.polarity = np.array([np.mean(polarities[stem]) for stem in vocabulary])
+
+    def score(self, bodies, clean_bodies=None):
+        if clean_bodies is None:
+            raise ValueError('LexiconSentiment scores the tokenized clean_body')
+        if self.vectorizer is None:
+            self.load_lexicon()
+        counts = self.vectorizer.transform(clean_bodies)
+        matched = np.asarray(counts.sum(axis=1)).ravel()
+        totals = counts @ self.polarity
+        return np.divide(totals, matched, out=np.zeros_like(totals), where=matched > 0).tolist()
+
+SENTIMENT_BACKENDS = {
+    'textblob': TextBlobSentiment,
+    'lexicon': LexiconSentiment,
+}
+
+def get_sentiment_backend(name=None):
+    return SENTIMENT_BACKENDS[name or os.getenv('SENTIMENT_BACKEND', 'textblob')]()
+
+def cached_sentiment(bodies, clean_bodies, backend, analysis_cache):
+    """Polarity for every body, analyzing each distinct content only once and in a single batch."""
+    polarities = [None] * len(bodies)
+    misses = {}
+    for i, body in enumerate(bodies):
+        cached = analysis_cache.get(backend.version, body) if analysis_cache is not None else None
+        if cached is not None:
+            polarities[i] = cached['sentiment']
+        else:
+            misses.setdefault(normalize_body(body), []).append(i)
+
+    if misses:
+        logging.info(f'Scoring sentiment of {len(misses)} distinct bodies with {backend.version}')
+        first = [rows[0] for rows in misses.values()]
+        scores = backend.score([bodies[i] for i in first],
+                               [clean_bodies[i] for i in first] if clean_bodies is not None else None)
+        for rows, score in zip(misses.values(), scores):
+            if analysis_cache is not None:
+                analysis_cache.put(backend.version, bodies[rows[0]], {'sentiment': score})
+            for i in rows:
+                polarities[i] = score
+    return polarities
@@ -2,14 +2,14 @@ import streamlit as st
 import pandas as pd
 import os
 import json
-import numpy as np
 from datetime import datetime, timedelta
-from sklearn.cluster import AgglomerativeClustering
 from pathlib import Path
 import base64
 
 # Import your custom clustering module
-from clustering import compute_tfidf
+from clustering import compute_tfidf_matrix, cluster_tfidf
+from page_resources import display_related_articles, get_image_cache, load_rollups
+from page_profiler import PageProfiler
 
 st.set_page_config(layout='wide', initial_sidebar_state='expanded')
 
@@ -30,6 +30,12 @@ def load_articles_from_cache(cache_file):
         st.error(f"Error loading cache: {e}")
         return pd.DataFrame()
 
+def articles_by_source_from_rollups(articles_df, start_date, end_date, sentiment):
+    rollups = load_rollups(lambda: articles_df.assign(date=articles_df['date'].dt.strftime('%Y-%m-%d'))
+                           .to_dict(orient='records'))
+    counts = rollups.article_counts(start_date, end_date, sentiments=[sentiment] if sentiment else None)
+    return counts.groupby('source')['count'].sum().sort_values(ascending=False)
+
 def filter_articles_by_keywords(articles, keywords):
     if not isinstance(keywords, list):
         keywords = [keywords] if keywords else []
@@ -69,13 +75,10 @@ def cluster_articles(articles_df, keyword):
 
     articles_df.fillna('', inplace=True)
 
-    tfidf_df = compute_tfidf(articles_df)
-    distance_threshold = 1.5
-    ac = AgglomerativeClustering(distance_threshold=distance_threshold, n_clusters=None)
-    articles_labeled = ac.fit_predict(tfidf_df)
+    articles_labeled = cluster_tfidf(compute_tfidf_matrix(articles_df))
 
     articles_df['cluster_id'] = articles_labeled
-    clusters = {str(n): articles_df[articles_df['cluster_id'] == n].to_dict(orient='records') for n in np.unique(articles_labeled)}
+    clusters = {str(n): group.to_dict(orient='records') for n, group in articles_df.groupby('cluster_id')}
 
     return articles_df, clusters
 
@@ -107,7 +110,7 @@ def display_articles(articles_df, clusters, clusters_per_row=3):
                 for _, article in articles:
                     if displayed_articles < 2:
                         if article.get('image_url'):
-                            st.image(article['image_url'], use_column_width=True)
+                            st.image(get_image_cache().image_source(article['image_url']), use_column_width=True)
 
                         st.markdown(f"### [{article.get('title')}]({article.get('url')})")
                         st.subheader(f"Source: {article.get('source')}")
@@ -120,6 +123,7 @@ def display_articles(articles_df, clusters, clusters_per_row=3):
                         st.write(f"Frequent Words: {', '.join(article.get('keywords', []))}")
                         st.write(f"Sentiment: {article.get('sentiment_category')}")
                         st.write(f"Cluster ID: {article.get('cluster_id')}")
+                        display_related_articles(article.get('url'))
                         st.write("---")
                         displayed_articles += 1
                     else:
@@ -129,7 +133,7 @@ def display_articles(articles_df, clusters, clusters_per_row=3):
                     with st.expander("Show more articles"):
                         for _, article in articles:
                             if article.get('image_url'):
-                                st.image(article['image_url'], use_column_width=True)
+                                st.image(get_image_cache().image_source(article['image_url']), use_column_width=True)
 
                             st.markdown(f"### [{article.get('title')}]({article.get('url')})")
                             st.subheader(f"Source: {article.get('source')}")
@@ -142,6 +146,7 @@ def display_articles(articles_df, clusters, clusters_per_row=3):
                             st.write(f"Frequent Words: {', '.join(article.get('keywords', []))}")
                             st.write(f"Sentiment: {article.get('sentiment_category')}")
                             st.write(f"Cluster ID: {article.get('cluster_id')}")
+                            display_related_articles(article.get('url'))
                             st.write("---")
 
 def img_to_bytes(img_path):
@@ -156,79 +161,90 @@ def img_to_html(img_path):
     return img_html
 
 if __name__ == '__main__':
-    # Display main logo centered at the top of the page with padding and background color
-    st.markdown(
-        f"""
-        <div style="display: flex; justify-content: center; align-items: center; background-color: #2E3859; border-radius: 10px;width:500px;margin:0 auto;margin-top:-55px;">
-            {img_to_html(LOGO_PATH)}
-        </div>
-        """,
-        unsafe_allow_html=True
-    )
-
-    st.title("News Articles")
+    # Phase timings of this rerun, only recorded with PAGE_PROFILE=1 or ?profile=1
+    with PageProfiler('app.py') as profiler:
 
-    # Sidebar filters
-    with st.sidebar:
-        # Display keyword logo above the search bar
+        # Display main logo centered at the top of the page with padding and background color
         st.markdown(
             f"""
-            <div style="width: 355px;display: flex; justify-content: center; align-items: center;margin-left:-40px">
-                {img_to_html(KEYWORD_LOGO_PATH)}
+            <div style="display: flex; justify-content: center; align-items: center; background-color: #2E3859; border-radius: 10px;width:500px;margin:0 auto;margin-top:-55px;">
+                {img_to_html(LOGO_PATH)}
             </div>
             """,
             unsafe_allow_html=True
         )
-        
-        keyword = st.text_input("Search articles by keyword")
-
-        articles_df = load_articles_from_cache(ARTICLES_CACHE_FILE)
-        
-        if not articles_df.empty:
-            articles_df['date'] = pd.to_datetime(articles_df['date'])
-            min_date = articles_df['date'].min().date()
-            max_date = articles_df['date'].max().date()
+
+        st.title("News Articles")
+
+        # Sidebar filters
+        with st.sidebar:
+            # Display keyword logo above the search bar
+            st.markdown(
+                f"""
+                <div style="width: 355px;display: flex; justify-content: center; align-items: center;margin-left:-40px">
+                    {img_to_html(KEYWORD_LOGO_PATH)}
+                </div>
+                """,
+                unsafe_allow_html=True
+            )
+
+            keyword = st.text_input("Search articles by keyword")
+
+            profiler.phase('load data')
+            articles_df = load_articles_from_cache(ARTICLES_CACHE_FILE)
+
+            if not articles_df.empty:
+                articles_df['date'] = pd.to_datetime(articles_df['date'])
+                min_date = articles_df['date'].min().date()
+                max_date = articles_df['date'].max().date()
+            else:
+                st.error("No articles found in cache.")
+                min_date = datetime.today().date() - timedelta(days=30)
+                max_date = datetime.today().date()
+
+            # Date filter slider with dynamic date range
+            start_date, end_date = st.slider(
+                "Filter articles by publication date",
+                min_value=min_date,
+                max_value=max_date,
+                value=(max_date, max_date) if not keyword else (min_date, max_date),
+                format="YYYY-MM-DD"
+            )
+
+            # Sentiment filter dropdown
+            sentiment = st.selectbox(
+                "Filter articles by sentiment",
+                options=["", "negative", "neutral", "positive"],
+                format_func=lambda x: "All" if x == "" else x.capitalize()
+            )
+
+        profiler.phase('filter')
+        if keyword:
+            filtered_articles = filter_articles_by_keywords(articles_df.to_dict(orient='records'), [keyword])
+            filtered_articles_df = pd.DataFrame(filtered_articles)
         else:
-            st.error("No articles found in cache.")
-            min_date = datetime.today().date() - timedelta(days=30)
-            max_date = datetime.today().date()
-
-        # Date filter slider with dynamic date range
-        start_date, end_date = st.slider(
-            "Filter articles by publication date",
-            min_value=min_date,
-            max_value=max_date,
-            value=(max_date, max_date) if not keyword else (min_date, max_date),
-            format="YYYY-MM-DD"
-        )
+            filtered_articles_df = articles_df
 
-        # Sentiment filter dropdown
-        sentiment = st.selectbox(
-            "Filter articles by sentiment",
-            options=["", "negative", "neutral", "positive"],
-            format_func=lambda x: "All" if x == "" else x.capitalize()
-        )
+        filtered_articles_df = filter_articles_by_date_and_sentiment(filtered_articles_df, start_date, end_date, sentiment)
 
-    if keyword:
-        filtered_articles = filter_articles_by_keywords(articles_df.to_dict(orient='records'), [keyword])
-        filtered_articles_df = pd.DataFrame(filtered_articles)
-    else:
-        filtered_articles_df = articles_df
+        # Display metrics in a column layout
+        col1, col2 = st.columns(2)
+        total_articles_scraped = len(articles_df)
+        total_articles_filtered = len(filtered_articles_df)
+        col1.metric("Total Articles Scraped", total_articles_scraped)
+        col2.metric("Total Articles Based on Filter", total_articles_filtered)
 
-    filtered_articles_df = filter_articles_by_date_and_sentiment(filtered_articles_df, start_date, end_date, sentiment)
-    
-    # Display metrics in a column layout
-    col1, col2 = st.columns(2)
-    total_articles_scraped = len(articles_df)
-    total_articles_filtered = len(filtered_articles_df)
-    col1.metric("Total Articles Scraped", total_articles_scraped)
-    col2.metric("Total Articles Based on Filter", total_articles_filtered)
-
-    # Display number of articles by source
-    articles_by_source = filtered_articles_df['source'].value_counts()
-    st.write("Articles by Source")
-    st.table(articles_by_source)
-
-    filtered_articles_df, clusters = cluster_articles(filtered_articles_df, keyword)
-    
-    display_articles(filtered_articles_df, clusters)
+        # Display number of articles by source, summed from the rollups unless a keyword is searched
+        profiler.phase('aggregate')
+        if keyword:
+            articles_by_source = filtered_articles_df['source'].value_counts()
+        else:
+            articles_by_source = articles_by_source_from_rollups(articles_df, start_date, end_date, sentiment)
+        st.write("Articles by Source")
+        st.table(articles_by_source)
+
+        profiler.phase('cluster')
+        filtered_articles_df, clusters = cluster_articles(filtered_articles_df, keyword)
+
+        profiler.phase('render')
+        display_articles(filtered_articles_df, clusters)
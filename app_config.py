@@ -0,0 +1,13 @@
+import os
+from functools import lru_cache
+import toml
+
+CONFIG_FILE = 'config.toml'
+
+@lru_cache(maxsize=None)
+def _load_config(config_file, mtime):
+    return toml.load(config_file)
+
+def load_config(config_file=CONFIG_FILE):
+    """Return the parsed config.toml, re-reading it only after the file changes."""
+    return _load_config(config_file, os.path.getmtime(config_file))
@@ -0,0 +1,93 @@
+"""Micro-benchmark for feed entry date parsing.
+
+Record the feeds listed in app/sources.json once:
+
+    python benchmarks/bench_date_parsing.py --record
+
+and then compare the dateutil-only parsing against the fast path as often as
+needed, without touching the network:
+
+    python benchmarks/bench_date_parsing.py
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from hashlib import sha1
+
+import dateutil.parser
+import feedparser as fp
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from scrapper import TZINFOS, parse_entry_date  # noqa: E402
+
+FEEDS_DIR = os.path.join(os.path.dirname(__file__), 'feeds')
+SOURCES_FILE = 'app/sources.json'
+
+def record_feeds(feeds_dir):
+    os.makedirs(feeds_dir, exist_ok=True)
+    with open(SOURCES_FILE, 'r') as f:
+        sources = json.load(f)
+    for content in sources.values():
+        for url in content['rss']:
+            d = fp.parse(url)
+            if d.get('bozo') and not d.entries:
+                print(f'Skipping {url}: {d.get("bozo_exception")}')
+                continue
+            path = os.path.join(feeds_dir, sha1(url.encode()).hexdigest() + '.json')
+            entries = [{'published': e.get('published'), 'published_parsed': list(e.published_parsed) if e.get('published_parsed') else None}
+                       for e in d.entries if e.get('published')]
+            with open(path, 'w') as f:
+                json.dump({'url': url, 'entries': entries}, f)
+            print(f'Recorded {len(entries)} entries from {url}')
+
+def load_entries(feeds_dir):
+    entries = []
+    for name in sorted(os.listdir(feeds_dir)):
+        if name.endswith('.json'):
+            with open(os.path.join(feeds_dir, name), 'r') as f:
+                entries.extend(fp.FeedParserDict(e) for e in json.load(f)['entries'])
+    return entries
+
+def parse_with_dateutil(entry):
+    return dateutil.parser.parse(entry['published'], tzinfos=TZINFOS)
+
+def parse_without_struct(entry):
+    return parse_entry_date({'published': entry['published']})
+
+def bench(label, func, entries, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for entry in entries:
+            func(entry)
+        best = min(best, time.perf_counter() - start)
+    per_entry = best / len(entries) * 1e6
+    print(f'{label:<28} {best * 1000:9.2f} ms  {per_entry:8.2f} us/entry')
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--record', action='store_true', help='download the feeds in app/sources.json first')
+    parser.add_argument('--feeds-dir', default=FEEDS_DIR)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.record:
+        record_feeds(args.feeds_dir)
+
+    if not os.path.isdir(args.feeds_dir):
+        sys.exit(f'No recorded feeds in {args.feeds_dir}, run with --record first')
+    entries = load_entries(args.feeds_dir)
+    if not entries:
+        sys.exit('Recorded feeds contain no dated entries')
+
+    print(f'{len(entries)} entries, best of {args.repeat} runs')
+    baseline = bench('dateutil + tzinfos', parse_with_dateutil, entries, args.repeat)
+    rfc822 = bench('rfc822 with dateutil fallback', parse_without_struct, entries, args.repeat)
+    fast = bench('published_parsed fast path', parse_entry_date, entries, args.repeat)
+    print(f'Speed-up: rfc822 {baseline / rfc822:.1f}x, fast path {baseline / fast:.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Compare the clustering backends on quality and wall time.
+
+Uses the cached corpus by default, or a synthetic topic-mixture corpus to
+check the time budget at sizes we do not have yet:
+
+    python benchmarks/compare_clustering.py
+    python benchmarks/compare_clustering.py --synthetic 100000 --budget 60
+
+Agglomerative clustering is skipped above AGGLOMERATIVE_MAX_ARTICLES unless
+--force is given, since it needs a dense n x n distance matrix. Every run
+first checks that each backend puts exact duplicates (reposts) in one
+cluster, and exits with an error if one does not.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics import adjusted_rand_score, silhouette_score
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from clustering import (  # noqa: E402
+    AGGLOMERATIVE_MAX_ARTICLES, CACHE_FILE, CLUSTERING_BACKENDS, choose_clustering_backend, compute_tfidf_matrix,
+)
+
+SILHOUETTE_SAMPLE = 2000
+AGREEMENT_SAMPLE = 3000
+
+def synthetic_corpus(n_articles, n_topics=None, seed=42):
+    """Articles drawn from overlapping topic vocabularies, with the topic as ground truth."""
+    rng = np.random.default_rng(seed)
+    n_topics = n_topics or max(2, n_articles // 25)
+    vocabulary = np.array([f'term{i}' for i in range(max(5000, n_topics * 10))])
+    topics = [rng.choice(len(vocabulary), size=40, replace=False) for _ in range(n_topics)]
+    labels = rng.integers(0, n_topics, size=n_articles)
+    bodies = [' '.join(np.concatenate([vocabulary[rng.choice(topics[t], size=60)],
+                                       vocabulary[rng.integers(0, len(vocabulary), size=40)]]))
+              for t in labels]
+    return pd.DataFrame({'clean_body': bodies}), labels
+
+def cached_corpus():
+    with open(CACHE_FILE, 'r') as f:
+        articles = json.load(f)
+    news_df = pd.DataFrame(articles.values())
+    return news_df[news_df['clean_body'].notna()], None
+
+def check_duplicates():
+    """Names of the backends that split identical articles into different clusters."""
+    repost = 'central bank raises interest rates again as inflation stays high'
+    bodies = [repost] * 3 + ['football final ends in penalties', 'storm closes schools on the coast',
+                             'new phone released with a bigger screen']
+    tfidf_matrix = TfidfVectorizer().fit_transform(bodies)
+    failed = []
+    for name, backend in CLUSTERING_BACKENDS.items():
+        labels = backend(tfidf_matrix)
+        if len(set(labels[:3])) != 1:
+            failed.append(name)
+            print(f'{name:<18} splits exact duplicates: {labels}')
+    return failed
+
+def run_backend(name, tfidf_matrix):
+    start = time.perf_counter()
+    labels = CLUSTERING_BACKENDS[name](tfidf_matrix)
+    return labels, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--synthetic', type=int, metavar='N', help='use N synthetic articles instead of the cache')
+    parser.add_argument('--budget', type=float, default=60.0, help='time budget in seconds')
+    parser.add_argument('--force', action='store_true', help='run agglomerative clustering at any size')
+    args = parser.parse_args()
+
+    if check_duplicates():
+        sys.exit(1)
+
+    if args.synthetic:
+        news_df, truth = synthetic_corpus(args.synthetic)
+        tfidf_matrix = TfidfVectorizer().fit_transform(news_df['clean_body'])
+    else:
+        news_df, truth = cached_corpus()
+        tfidf_matrix = compute_tfidf_matrix(news_df)
+    n_articles = tfidf_matrix.shape[0]
+    print(f'{n_articles} articles, {tfidf_matrix.shape[1]} terms, auto backend: {choose_clustering_backend(n_articles)}')
+
+    rng = np.random.default_rng(0)
+    silhouette_rows = rng.choice(n_articles, size=min(SILHOUETTE_SAMPLE, n_articles), replace=False)
+    ran = []
+    for name in CLUSTERING_BACKENDS:
+        if name == 'agglomerative' and n_articles > AGGLOMERATIVE_MAX_ARTICLES and not args.force:
+            print(f'{name:<18} skipped above {AGGLOMERATIVE_MAX_ARTICLES} articles')
+            continue
+        labels, seconds = run_backend(name, tfidf_matrix)
+        ran.append(name)
+        n_clusters = len(np.unique(labels))
+        sample_labels = labels[silhouette_rows]
+        silhouette = (silhouette_score(tfidf_matrix[silhouette_rows], sample_labels, metric='cosine')
+                      if 1 < len(np.unique(sample_labels)) < len(sample_labels) else float('nan'))
+        line = f'{name:<18} {seconds:8.2f} s  {n_clusters:7d} clusters  silhouette {silhouette:6.3f}'
+        if truth is not None:
+            line += f'  ARI vs topics {adjusted_rand_score(truth, labels):6.3f}'
+        line += '  within budget' if seconds <= args.budget else '  OVER BUDGET'
+        print(line)
+
+    # How closely the scalable backends reproduce the exact clustering on a shared sample
+    sample = np.sort(rng.choice(n_articles, size=min(AGREEMENT_SAMPLE, n_articles), replace=False))
+    exact = CLUSTERING_BACKENDS['agglomerative'](tfidf_matrix[sample])
+    for name in ran:
+        if name != 'agglomerative':
+            approx = CLUSTERING_BACKENDS[name](tfidf_matrix[sample])
+            print(f'ARI {name} vs agglomerative on {len(sample)} articles: {adjusted_rand_score(exact, approx):.3f}')
+
+if __name__ == '__main__':
+    main()
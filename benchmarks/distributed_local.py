@@ -0,0 +1,146 @@
+"""Run the multi-process scrape against local feeds and check what it stored.
+
+Serves overlapping RSS feeds, articles and article images from a stand-in
+publisher on the loopback network, then runs ``distributed_scrape.py run``
+with each number of workers in a fresh directory and checks that every
+article was cached exactly once and every image landed in the shared
+thumbnail cache:
+
+    python benchmarks/distributed_local.py
+    python benchmarks/distributed_local.py --workers 1 2 4 8 --feeds 16 --delay 0.5
+
+Only the stand-in server is contacted. With --serve it runs until
+interrupted, to point workers at it by hand.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+DISTRIBUTED_SCRAPE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'distributed_scrape.py')
+HOST = '127.0.0.1'
+# Consecutive feeds share half of their articles, so workers race to claim them
+ARTICLES_PER_FEED = 10
+FEED_STRIDE = 5
+WORDS = 'market stocks inflation rates bank earnings oil prices growth economy jobs report investors trade'.split()
+
+class PublisherHandler(BaseHTTPRequestHandler):
+    delay = 0.2
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        port = self.server.server_address[1]
+        if self.path.startswith('/feed/'):
+            self.respond(200, 'application/rss+xml', self.feed(port, int(self.path.split('/')[2].split('.')[0])).encode())
+        elif self.path.startswith('/article/'):
+            time.sleep(self.delay)
+            n = int(self.path.split('/')[2])
+            paragraphs = ''.join(f'<p>{" ".join(WORDS[(n + i) % len(WORDS):] + WORDS)}.</p>' for i in range(6))
+            self.respond(200, 'text/html', (
+                f'<html><head><title>Story number {n} on the markets today</title>'
+                f'<meta property="og:image" content="http://{HOST}:{port}/image/{n}.png"></head>'
+                f'<body><article><h1>Story number {n} on the markets today</h1>{paragraphs}</article></body></html>'
+            ).encode())
+        elif self.path.startswith('/image/'):
+            n = int(self.path.split('/')[2].split('.')[0])
+            buffer = io.BytesIO()
+            Image.new('RGB', (800, 450), (n * 37 % 256, n * 91 % 256, n * 13 % 256)).save(buffer, format='PNG')
+            self.respond(200, 'image/png', buffer.getvalue())
+        else:
+            self.respond(404, 'text/plain', b'Not Found')
+
+    def feed(self, port, feed):
+        now = datetime.now(timezone.utc)
+        first = feed * FEED_STRIDE
+        items = ''.join(f'<item><title>Story {n}</title><link>http://{HOST}:{port}/article/{n}</link>'
+                        f'<pubDate>{format_datetime(now - timedelta(hours=n % 48))}</pubDate></item>'
+                        for n in range(first, first + ARTICLES_PER_FEED))
+        return f"<?xml version='1.0'?><rss version='2.0'><channel><title>Feed {feed}</title>{items}</channel></rss>"
+
+    def respond(self, status, content_type, data):
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def start_server(port, delay):
+    PublisherHandler.delay = delay
+    server = ThreadingHTTPServer((HOST, port), PublisherHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def run_workers(port, feeds, workers):
+    """Scrape all feeds with ``workers`` processes; return the duration and what went wrong."""
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, 'app'))
+        with open(os.path.join(tmp, 'app', 'sources.json'), 'w') as f:
+            json.dump({'Local': {'rss': [f'http://{HOST}:{port}/feed/{feed}.xml' for feed in range(feeds)]}}, f)
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, DISTRIBUTED_SCRAPE, 'run', '--workers', str(workers)],
+                                cwd=tmp, capture_output=True, text=True)
+        duration = time.perf_counter() - start
+
+        problems = []
+        if result.returncode != 0:
+            problems.append(f'exit code {result.returncode}: {result.stderr.strip().splitlines()[-1:]}')
+        for line in result.stderr.splitlines():
+            if 'Traceback' in line or 'Error' in line:
+                problems.append(line.strip())
+        cache = {}
+        if os.path.exists(os.path.join(tmp, 'article_cache.json')):
+            with open(os.path.join(tmp, 'article_cache.json'), 'r') as f:
+                cache = json.load(f)
+        expected = (feeds - 1) * FEED_STRIDE + ARTICLES_PER_FEED
+        links = [article['url'] for article in cache.values()]
+        if len(cache) != expected:
+            problems.append(f'{len(cache)} articles cached, expected {expected}')
+        if len(set(links)) != len(links):
+            problems.append(f'{len(links) - len(set(links))} articles cached twice')
+        index_file = os.path.join(tmp, 'image_cache', 'index.json')
+        if os.path.exists(index_file):
+            with open(index_file, 'r') as f:
+                images = len(json.load(f))
+            if images != len(cache):
+                problems.append(f'{images} thumbnails indexed for {len(cache)} articles')
+    return duration, problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8812)
+    parser.add_argument('--feeds', type=int, default=8)
+    parser.add_argument('--delay', type=float, default=0.3, help='seconds each article takes to answer')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--serve', action='store_true', help='only run the stand-in publisher')
+    args = parser.parse_args()
+
+    start_server(args.port, args.delay)
+    if args.serve:
+        print(f'Feeds at http://{HOST}:{args.port}/feed/0.xml to /feed/{args.feeds - 1}.xml')
+        threading.Event().wait()
+
+    failed = False
+    for workers in args.workers:
+        duration, problems = run_workers(args.port, args.feeds, workers)
+        print(f'{workers:3d} workers {duration:8.2f} s  ' + ('ok' if not problems else '; '.join(problems[:5])))
+        failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
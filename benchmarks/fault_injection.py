@@ -0,0 +1,141 @@
+"""Scrape duration with failing publishers, with and without the fetch guard.
+
+Serves RSS feeds and articles from four local stand-in hosts on the
+loopback network: a healthy one, one whose articles answer slower than the
+request timeout, one whose articles fail with HTTP 500 and one whose feeds
+never answer in time. Each scenario scrapes them all in a fresh directory:
+
+    python benchmarks/fault_injection.py
+    python benchmarks/fault_injection.py --timeout 2 --budget 20
+
+Only the stand-in servers are contacted. With --serve the servers run until
+interrupted, to point a scrape at them by hand.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import scrapper  # noqa: E402
+from fetch_guard import FetchGuard  # noqa: E402
+
+HOSTS = {
+    '127.0.0.1': 'healthy',
+    '127.0.0.2': 'slow',
+    '127.0.0.3': 'error',
+    '127.0.0.4': 'dead feed',
+}
+FEEDS_PER_HOST = 2
+ARTICLES_PER_FEED = 10
+WORDS = 'market stocks inflation rates bank earnings oil prices growth economy jobs report investors trade'.split()
+
+requests_by_host = Counter()
+
+class FaultyHandler(BaseHTTPRequestHandler):
+    delay = 3.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        host = self.server.server_address[0]
+        mode = HOSTS[host]
+        requests_by_host[host] += 1
+        if self.path.startswith('/feed/'):
+            if mode == 'dead feed':
+                time.sleep(self.delay)
+            self.respond(200, 'application/rss+xml', self.feed(host, int(self.path.split('/')[2].split('.')[0])))
+        elif self.path.startswith('/article/'):
+            if mode == 'slow':
+                time.sleep(self.delay)
+            if mode == 'error':
+                self.respond(500, 'text/plain', 'Internal Server Error')
+                return
+            n = int(self.path.split('/')[2])
+            paragraphs = ''.join(f'<p>{" ".join(WORDS[(n + i) % len(WORDS):] + WORDS)}.</p>' for i in range(6))
+            self.respond(200, 'text/html', f'<html><head><title>Story {n} from {host}</title></head>'
+                                           f'<body><article><h1>Story {n} from {host}</h1>{paragraphs}</article></body></html>')
+        else:
+            self.respond(404, 'text/plain', 'Not Found')
+
+    def feed(self, host, feed):
+        now = datetime.now(timezone.utc)
+        port = self.server.server_address[1]
+        items = ''.join(f'<item><title>Story {n}</title><link>http://{host}:{port}/article/{n}</link>'
+                        f'<pubDate>{format_datetime(now - timedelta(hours=n % 24))}</pubDate></item>'
+                        for n in range(feed * ARTICLES_PER_FEED, (feed + 1) * ARTICLES_PER_FEED))
+        return f"<?xml version='1.0'?><rss version='2.0'><channel><title>{host} {feed}</title>{items}</channel></rss>"
+
+    def respond(self, status, content_type, body):
+        data = body.encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up waiting
+            pass
+
+def start_servers(port, delay):
+    FaultyHandler.delay = delay
+    servers = [ThreadingHTTPServer((host, port), FaultyHandler) for host in HOSTS]
+    for server in servers:
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return servers
+
+def sources(port):
+    return {f'{mode} ({host})': {'rss': [f'http://{host}:{port}/feed/{feed}.xml' for feed in range(FEEDS_PER_HOST)]}
+            for host, mode in HOSTS.items()}
+
+def run_scenario(label, port, guard, budget):
+    requests_by_host.clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            scraper = scrapper.Scraper(sources(port), 7, scrapper.CacheManager(),
+                                       guard=FetchGuard() if guard else None, budget_seconds=budget)
+            start = time.perf_counter()
+            articles = scraper.scrape()
+            duration = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    requests = ', '.join(f'{HOSTS[host]} {requests_by_host[host]}' for host in HOSTS)
+    print(f'{label:<24} {duration:8.2f} s  {len(articles):4d} articles  requests: {requests}')
+    return duration
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8811)
+    parser.add_argument('--timeout', type=float, default=1.0, help='feed and article request timeout in seconds')
+    parser.add_argument('--budget', type=int, default=10, help='scrape budget in seconds for the budgeted run')
+    parser.add_argument('--serve', action='store_true', help='only run the stand-in servers')
+    args = parser.parse_args()
+
+    # Faulty hosts answer a bit later than the timeout allows
+    start_servers(args.port, args.timeout * 2)
+    if args.serve:
+        for line in (f'{mode:<10} http://{host}:{args.port}/feed/0.xml' for host, mode in HOSTS.items()):
+            print(line)
+        threading.Event().wait()
+
+    scrapper.FEED_TIMEOUT = args.timeout
+    scrapper.config.request_timeout = args.timeout
+    print(f'{len(HOSTS) * FEEDS_PER_HOST} feeds of {ARTICLES_PER_FEED} articles, {args.timeout:g} s timeout')
+    baseline = run_scenario('no guard', args.port, guard=False, budget=None)
+    guarded = run_scenario('circuit breakers', args.port, guard=True, budget=None)
+    run_scenario(f'no guard, {args.budget} s budget', args.port, guard=False, budget=args.budget)
+    print(f'Speed-up with circuit breakers: {baseline / guarded:.1f}x')
+
+if __name__ == '__main__':
+    main()
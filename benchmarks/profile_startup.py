@@ -0,0 +1,71 @@
+"""Startup profile of the Streamlit pages.
+
+For every page, imports its top-level modules in a fresh interpreter with
+``-X importtime`` and prints the total import time and the slowest modules,
+then times a first full run of the page with Streamlit's AppTest against the
+current article_cache.json:
+
+    python benchmarks/profile_startup.py
+    python benchmarks/profile_startup.py main_page.py --top 20
+"""
+import argparse
+import ast
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+PAGES = ['main_page.py', 'pages/all_clusters.py', 'pages/cluster.py', 'app.py']
+
+def top_level_imports(page):
+    with open(os.path.join(ROOT, page), 'r') as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.append(node.module)
+    return modules
+
+def import_profile(modules):
+    """Return (total seconds, [(cumulative seconds, module)]) for importing ``modules``."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + ', '.join(modules)],
+                            cwd=ROOT, capture_output=True, text=True)
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        timings.append((int(cumulative) / 1e6, name.rstrip()))
+    top_level = [(seconds, name.strip()) for seconds, name in timings if not name.startswith('  ')]
+    return sum(seconds for seconds, _ in top_level), sorted(timings, reverse=True)
+
+def first_run(page):
+    from streamlit.testing.v1 import AppTest
+
+    start = time.perf_counter()
+    at = AppTest.from_file(os.path.join(ROOT, page), default_timeout=300).run()
+    return time.perf_counter() - start, [e.value for e in at.exception]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pages', nargs='*', default=PAGES)
+    parser.add_argument('--top', type=int, default=10, help='number of slowest modules to list')
+    parser.add_argument('--no-run', action='store_true', help='only profile imports')
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    for page in args.pages:
+        modules = top_level_imports(page)
+        total, timings = import_profile(modules)
+        print(f'{page}: top-level imports take {total:.2f} s ({", ".join(modules)})')
+        for seconds, name in timings[:args.top]:
+            print(f'    {seconds:6.3f} s  {name.strip()}')
+        if not args.no_run:
+            seconds, errors = first_run(page)
+            print(f'  first run: {seconds:.2f} s' + (f', errors: {errors}' if errors else ''))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import pandas as pd
+
+def _value_mix(news_df, column):
+    counts = news_df.groupby(['cluster_id', column]).size()
+    mix = {}
+    for (cluster_id, value), count in counts.items():
+        mix.setdefault(cluster_id, {})[value] = int(count)
+    return pd.Series(mix, dtype=object)
+
+def _top_keywords(news_df, top_n):
+    keywords = news_df[['cluster_id', 'keywords']].explode('keywords').dropna(subset=['keywords'])
+    keywords = keywords[keywords['keywords'] != '']
+    counts = keywords.groupby(['cluster_id', 'keywords']).size().sort_values(ascending=False, kind='stable')
+    top = counts.groupby(level='cluster_id').head(top_n).reset_index()
+    return top.groupby('cluster_id')['keywords'].agg(list)
+
+def summarize_clusters(news_df, top_n=3):
+    """Summarize every cluster of a clustered article frame in one grouped pass.
+
+    Returns a frame indexed by cluster_id with the member urls and titles,
+    the ``top_n`` most frequent keywords, per-source and per-sentiment
+    counts and the first and last publication date.
+    """
+    grouped = news_df.groupby('cluster_id')
+    summary = pd.DataFrame({
+        'size': grouped.size(),
+        'urls': grouped['url'].agg(list),
+        'titles': grouped['title'].agg(list),
+        'first_date': grouped['date'].min(),
+        'last_date': grouped['date'].max(),
+    })
+    summary['top_keywords'] = _top_keywords(news_df, top_n).reindex(summary.index)
+    summary['top_keywords'] = summary['top_keywords'].apply(lambda x: x if isinstance(x, list) else [])
+    summary['sources'] = _value_mix(news_df, 'source').reindex(summary.index)
+    summary['sentiments'] = _value_mix(news_df, 'sentiment_category').reindex(summary.index)
+    summary['n_sources'] = summary['sources'].apply(len)
+    return summary
@@ -1,13 +1,32 @@
 import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import AgglomerativeClustering
+import scipy.sparse as sp
 import json
 import logging
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
+import os
+from hashlib import sha1
+from datetime import datetime, timezone
+
+# scikit-learn and joblib are imported inside the functions that need them so
+# the Streamlit pages can render their header and filters before paying for them
 
 CACHE_FILE = 'article_cache.json'
+TFIDF_VECTORIZER_FILE = 'tfidf_vectorizer.joblib'
+TFIDF_MATRIX_FILE = 'tfidf_matrix.npz'
+TFIDF_META_FILE = 'tfidf_meta.json'
+
+# Exact agglomerative clustering needs a dense n x n distance matrix, so larger
+# corpora switch to the kNN graph and then to k-means partitioned kNN graphs
+AGGLOMERATIVE_MAX_ARTICLES = 2000
+KNN_GRAPH_MAX_ARTICLES = 10000
+DISTANCE_THRESHOLD = 1.5
+KNN_NEIGHBORS = 10
+KNN_MAX_COSINE_DISTANCE = 0.6
+KMEANS_PARTITION_SIZE = 2000
+KMEANS_MAX_DEPTH = 4
+
+# Corpus-level TF-IDF store, reloaded whenever clustering.py rebuilds it
+_tfidf_store = {'mtime': None, 'vectorizer': None, 'matrix': None, 'rows': None, 'version': None}
 
 class Helper:
     @staticmethod
@@ -24,12 +43,191 @@ class Helper:
         news_df = news_df[news_df.body.str.count(r'\s+').ge(20)]
         return news_df
 
+def corpus_version(urls):
+    return sha1('\n'.join(sorted(urls)).encode()).hexdigest()[:12]
+
+def build_tfidf_store(news_df):
+    """Fit the vectorizer once on the whole corpus and persist it with its document-term matrix."""
+    import joblib
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    logging.info("Building corpus TF-IDF store")
+    vectorizer = TfidfVectorizer()
+    tfidf_matrix = vectorizer.fit_transform(news_df['clean_body'].fillna(''))
+    urls = news_df['url'].tolist()
+    version = corpus_version(urls)
+    built_at = datetime.now(timezone.utc)
+
+    # Pages may load the store while it is rebuilt, so every build writes new
+    # files and the meta file is swapped in last to point at them
+    build = f'{version}-{built_at.strftime("%Y%m%d%H%M%S%f")}'
+    vectorizer_file = _build_file(TFIDF_VECTORIZER_FILE, build)
+    matrix_file = _build_file(TFIDF_MATRIX_FILE, build)
+    joblib.dump(vectorizer, vectorizer_file)
+    sp.save_npz(matrix_file, tfidf_matrix.tocsr())
+    previous = _read_tfidf_meta()
+    tmp_file = f'{TFIDF_META_FILE}.{os.getpid()}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({'version': version, 'built_at': built_at.isoformat(), 'urls': urls,
+                   'vectorizer_file': vectorizer_file, 'matrix_file': matrix_file}, f)
+    os.replace(tmp_file, TFIDF_META_FILE)
+    # Keep the previous build for pages that read the old meta file just before the swap
+    keep = {vectorizer_file, matrix_file}
+    if previous is not None:
+        keep.update((previous.get('vectorizer_file'), previous.get('matrix_file')))
+    for template in (TFIDF_VECTORIZER_FILE, TFIDF_MATRIX_FILE):
+        for path in _build_files(template):
+            if path not in keep:
+                os.remove(path)
+    logging.info(f'TF-IDF store {version}: {tfidf_matrix.shape[0]} articles, {tfidf_matrix.shape[1]} terms')
+    return version
+
+def _build_file(template, build):
+    name, extension = os.path.splitext(template)
+    return f'{name}.{build}{extension}'
+
+def _build_files(template):
+    name, extension = os.path.splitext(template)
+    return [entry for entry in os.listdir('.') if entry.startswith(name + '.') and entry.endswith(extension)]
+
+def _read_tfidf_meta():
+    if not os.path.exists(TFIDF_META_FILE):
+        return None
+    with open(TFIDF_META_FILE, 'r') as f:
+        return json.load(f)
+
+def load_tfidf_store():
+    if not os.path.exists(TFIDF_META_FILE):
+        return None
+    mtime = os.path.getmtime(TFIDF_META_FILE)
+    if _tfidf_store['mtime'] != mtime:
+        import joblib
+
+        logging.info("Loading corpus TF-IDF store")
+        meta = _read_tfidf_meta()
+        _tfidf_store.update(
+            mtime=mtime,
+            vectorizer=joblib.load(meta.get('vectorizer_file', TFIDF_VECTORIZER_FILE)),
+            matrix=sp.load_npz(meta.get('matrix_file', TFIDF_MATRIX_FILE)).tocsr(),
+            rows={url: i for i, url in enumerate(meta['urls'])},
+            version=meta['version'],
+        )
+    return _tfidf_store
+
+def _clean_bodies(news_df, mask, load_clean_body):
+    if load_clean_body is None or 'clean_body' in news_df.columns:
+        return news_df.loc[mask, 'clean_body']
+    return load_clean_body(news_df.index[mask])
+
+def compute_tfidf_matrix(news_df, load_clean_body=None):
+    """Return the sparse TF-IDF rows for ``news_df``.
+
+    Rows come straight from the corpus store built by clustering.py; articles
+    newer than the store are transformed with the stored vocabulary. The
+    vectorizer is only fitted here when no store exists yet. Frames without
+    a clean_body column pass ``load_clean_body``, called with the index of
+    the rows whose text is needed.
+    """
+    store = load_tfidf_store()
+    if store is None or 'url' not in news_df.columns:
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        logging.info("Computing TF-IDF values")
+        return TfidfVectorizer().fit_transform(_clean_bodies(news_df, slice(None), load_clean_body))
+
+    rows = news_df['url'].map(store['rows'])
+    known = rows.notna().to_numpy()
+    if known.all():
+        return store['matrix'][rows.to_numpy(dtype=np.int64)]
+
+    logging.info(f'Transforming {(~known).sum()} articles missing from TF-IDF store {store["version"]}')
+    missing_matrix = store['vectorizer'].transform(_clean_bodies(news_df, ~known, load_clean_body))
+    stacked = sp.vstack([store['matrix'][rows[known].to_numpy(dtype=np.int64)], missing_matrix]).tocsr()
+    order = np.concatenate([np.flatnonzero(known), np.flatnonzero(~known)])
+    return stacked[np.argsort(order)]
+
 def compute_tfidf(news_df):
-    logging.info("Computing TF-IDF values")
-    tfidf_matrix = TfidfVectorizer().fit_transform(news_df['clean_body'])
-    tfidf_array = np.asarray(tfidf_matrix.todense())
+    tfidf_array = np.asarray(compute_tfidf_matrix(news_df).todense())
     return tfidf_array
 
+def agglomerative_clusters(tfidf_matrix):
+    from sklearn.cluster import AgglomerativeClustering
+
+    dense = tfidf_matrix.toarray() if sp.issparse(tfidf_matrix) else tfidf_matrix
+    clustering_model = AgglomerativeClustering(n_clusters=None, distance_threshold=DISTANCE_THRESHOLD)
+    return clustering_model.fit_predict(dense)
+
+def knn_graph_clusters(tfidf_matrix):
+    """Connected components of the graph linking each article to its close nearest neighbours."""
+    from scipy.sparse.csgraph import connected_components
+    from sklearn.neighbors import NearestNeighbors
+
+    n_articles = tfidf_matrix.shape[0]
+    if n_articles < 2:
+        return np.zeros(n_articles, dtype=np.int64)
+    nn = NearestNeighbors(n_neighbors=min(KNN_NEIGHBORS, n_articles - 1), metric='cosine', algorithm='brute')
+    graph = nn.fit(tfidf_matrix).kneighbors_graph(mode='distance')
+    # Keep the edges as a connectivity mask, identical articles are 0 apart and must stay linked
+    graph.data = (graph.data <= KNN_MAX_COSINE_DISTANCE).astype(np.int8)
+    graph.eliminate_zeros()
+    _, labels = connected_components(graph, directed=False)
+    return labels
+
+def minibatch_kmeans_clusters(tfidf_matrix, depth=0):
+    """Split the corpus into mini-batch k-means partitions and cluster each one with the kNN graph.
+
+    The brute-force neighbour search is quadratic, so it only runs on
+    partitions of at most twice KMEANS_PARTITION_SIZE articles; k-means
+    partitions are uneven, so larger ones are split again.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    n_articles = tfidf_matrix.shape[0]
+    if n_articles <= 2 * KMEANS_PARTITION_SIZE or depth >= KMEANS_MAX_DEPTH:
+        return knn_graph_clusters(tfidf_matrix)
+
+    kmeans = MiniBatchKMeans(n_clusters=n_articles // KMEANS_PARTITION_SIZE, init='random', n_init=1,
+                             batch_size=4096, random_state=42)
+    partitions = kmeans.fit_predict(tfidf_matrix)
+
+    labels = np.empty(n_articles, dtype=np.int64)
+    order = np.argsort(partitions, kind='stable')
+    _, starts = np.unique(partitions[order], return_index=True)
+    next_label = 0
+    for rows in np.split(order, starts[1:]):
+        partition_labels = minibatch_kmeans_clusters(tfidf_matrix[rows], depth + 1)
+        labels[rows] = partition_labels + next_label
+        next_label += partition_labels.max() + 1
+    return labels
+
+CLUSTERING_BACKENDS = {
+    'agglomerative': agglomerative_clusters,
+    'knn_graph': knn_graph_clusters,
+    'minibatch_kmeans': minibatch_kmeans_clusters,
+}
+
+def choose_clustering_backend(n_articles):
+    if n_articles <= AGGLOMERATIVE_MAX_ARTICLES:
+        return 'agglomerative'
+    if n_articles <= KNN_GRAPH_MAX_ARTICLES:
+        return 'knn_graph'
+    return 'minibatch_kmeans'
+
+def cluster_tfidf(tfidf_matrix, backend=None):
+    """Assign a cluster id to every row of ``tfidf_matrix``.
+
+    ``backend`` is one of CLUSTERING_BACKENDS or 'auto', defaulting to the
+    CLUSTERING_BACKEND environment variable; 'auto' picks by corpus size.
+    """
+    n_articles = tfidf_matrix.shape[0]
+    if n_articles < 2:
+        return np.zeros(n_articles, dtype=np.int64)
+    backend = backend or os.getenv('CLUSTERING_BACKEND', 'auto')
+    if backend == 'auto':
+        backend = choose_clustering_backend(n_articles)
+    logging.info(f'Clustering {n_articles} articles with {backend}')
+    return CLUSTERING_BACKENDS[backend](tfidf_matrix)
+
 def find_featured_clusters(clusters):
     logging.info("Finding clusters with articles from multiple sources")
     featured_clusters = {}
@@ -44,36 +242,19 @@ def main():
         articles = json.load(f)
     
     news_df = pd.DataFrame(articles.values())
+    build_tfidf_store(news_df)
     helper = Helper()
     news_df = helper.clean_dataframe(news_df)
-    tfidf_array = compute_tfidf(news_df)
-    
-    clustering_model = AgglomerativeClustering(n_clusters=None, distance_threshold=1.5)
-    news_df['cluster_id'] = clustering_model.fit_predict(tfidf_array)
+    news_df['cluster_id'] = cluster_tfidf(compute_tfidf_matrix(news_df))
     
-    clusters = {str(cluster_id): news_df[news_df.cluster_id == cluster_id].to_dict(orient='records')
-                for cluster_id in np.unique(news_df.cluster_id)}
+    clusters = {str(cluster_id): group.to_dict(orient='records') for cluster_id, group in news_df.groupby('cluster_id')}
     
     featured_clusters = find_featured_clusters(clusters)
     
     logging.info("Saving clusters to cache")
-    with open(CACHE_FILE, 'w') as f:
+    with open(CACHE_FILE + '.tmp', 'w') as f:
         json.dump(articles, f, indent=4)
+    os.replace(CACHE_FILE + '.tmp', CACHE_FILE)
 
 if __name__ == "__main__":
     main()
-
-def cluster_articles(titles, n_clusters=5):
-    vectorizer = TfidfVectorizer(stop_words='english')
-    X = vectorizer.fit_transform(titles)
-
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    kmeans.fit(X)
-
-    clusters = {}
-    for idx, label in enumerate(kmeans.labels_):
-        if label not in clusters:
-            clusters[label] = []
-        clusters[label].append(titles[idx])
-
-    return clusters
@@ -0,0 +1,220 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+
+TEXT_STORE_FILE = 'article_text.sqlite'
+TEXT_FIELDS = ('body', 'summary', 'clean_body')
+EPOCH = date(1970, 1, 1)
+# Category of articles cached by a running scrape, before process_articles scores them
+UNSCORED = 'unscored'
+
+class TextStore:
+    """Article texts in SQLite, read by url only for the articles a page shows."""
+
+    def __init__(self, store_file=TEXT_STORE_FILE):
+        self.store_file = store_file
+        self.lock = threading.Lock()
+        # Shared by the Streamlit sessions of one process, access goes through the lock
+        self.conn = sqlite3.connect(store_file, timeout=60, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS texts (url TEXT PRIMARY KEY, body TEXT, summary TEXT, clean_body TEXT)')
+
+    def add_missing(self, articles):
+        """Store the texts of the ``articles`` not stored yet, or stored before they were processed."""
+        with self.lock:
+            processed = dict(self.conn.execute("SELECT url, clean_body != '' FROM texts"))
+            rows = [(article['url'], *(article.get(field) or '' for field in TEXT_FIELDS))
+                    for article in articles
+                    if article['url'] not in processed or (not processed[article['url']] and article.get('clean_body'))]
+            if rows:
+                logging.info(f'Storing the texts of {len(rows)} articles')
+                with self.conn:
+                    self.conn.executemany('INSERT OR REPLACE INTO texts VALUES (?, ?, ?, ?)', rows)
+
+    def get(self, urls, field):
+        if field not in TEXT_FIELDS:
+            raise ValueError(f'Unknown text field {field}')
+        texts = {}
+        with self.lock:
+            # Stay below SQLite's limit on query parameters
+            for start in range(0, len(urls), 500):
+                chunk = urls[start:start + 500]
+                texts.update(self.conn.execute(
+                    f'SELECT url, {field} FROM texts WHERE url IN ({",".join("?" * len(chunk))})', chunk))
+        return [texts.get(url, '') for url in urls]
+
+    def search(self, text):
+        """Urls of the articles whose body contains ``text``, ignoring case."""
+        with self.lock:
+            return {url for url, in self.conn.execute('SELECT url FROM texts WHERE instr(lower(body), ?) > 0',
+                                                      (text.lower(),))}
+
+class ArticleRecord:
+    """Read-only view of one corpus article, indexable like the cached article dict.
+
+    ``texts`` holds the text fields loaded with the record, other text
+    fields are read from the text store when asked for.
+    """
+    __slots__ = ('corpus', 'id', 'texts')
+
+    def __init__(self, corpus, id, texts=None):
+        self.corpus = corpus
+        self.id = id
+        self.texts = texts or {}
+
+    def __getitem__(self, name):
+        if name in self.texts:
+            return self.texts[name]
+        return self.corpus.value(self.id, name)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+class Corpus:
+    """Compact column store of the cached articles for the pages.
+
+    Sources and sentiment categories are small integer codes into interned
+    category lists, dates are days since 1970, keywords are ids into one
+    shared vocabulary held in a flat array, and the long texts (body,
+    summary, clean_body) stay in a TextStore until a page asks for them by
+    article id. Ids are row numbers, valid for one ``version`` of the cache.
+    """
+
+    def __init__(self, articles, text_store, version=None):
+        articles = list(articles)
+        self.version = version
+        self.text_store = text_store
+        text_store.add_missing(articles)
+
+        self.urls = [article['url'] for article in articles]
+        self.titles = [article['title'] for article in articles]
+        self.image_urls = [sys.intern(article.get('image_url') or '') for article in articles]
+        self.sources, self.source_codes = self._categorize([article['source'] for article in articles], np.int16)
+        self.sentiment_categories, self.sentiment_codes = self._categorize(
+            [article.get('sentiment_category') or UNSCORED for article in articles], np.int8)
+        self.sentiments = np.array([article.get('sentiment') or 0.0 for article in articles], dtype=np.float32)
+        self.days = np.array([(date.fromisoformat(article['date']) - EPOCH).days for article in articles], dtype=np.int32)
+        self.seconds = np.array([self._seconds(article.get('time') or '') for article in articles], dtype=np.int32)
+
+        vocabulary = {}
+        keyword_ids = []
+        self.keyword_offsets = np.zeros(len(articles) + 1, dtype=np.int64)
+        for i, article in enumerate(articles):
+            keywords = article.get('keywords') or []
+            keyword_ids.extend(vocabulary.setdefault(sys.intern(keyword), len(vocabulary)) for keyword in keywords)
+            self.keyword_offsets[i + 1] = len(keyword_ids)
+        self.keyword_ids = np.array(keyword_ids, dtype=np.int32)
+        self.vocabulary = np.array(list(vocabulary), dtype=object)
+
+    @classmethod
+    def from_cache(cls, cache_file='article_cache.json', text_store=None):
+        with open(cache_file, 'r') as f:
+            articles = json.load(f).values()
+        return cls(articles, text_store or TextStore(), os.path.getmtime(cache_file))
+
+    def __len__(self):
+        return len(self.urls)
+
+    def records(self, ids, texts=()):
+        """Records of the articles ``ids`` for the article cards, with the ``texts`` fields loaded in one query each."""
+        ids = [int(id) for id in ids]
+        loaded = {field: self.texts(ids, field) for field in texts}
+        return [ArticleRecord(self, id, {field: values[i] for field, values in loaded.items()})
+                for i, id in enumerate(ids)]
+
+    def value(self, id, name):
+        if name == 'url':
+            return self.urls[id]
+        if name == 'title':
+            return self.titles[id]
+        if name == 'image_url':
+            return self.image_urls[id]
+        if name == 'source':
+            return self.sources[self.source_codes[id]]
+        if name == 'sentiment_category':
+            return self.sentiment_categories[self.sentiment_codes[id]]
+        if name == 'sentiment':
+            return float(self.sentiments[id])
+        if name == 'date':
+            return (EPOCH + timedelta(days=int(self.days[id]))).isoformat()
+        if name == 'time':
+            minutes, seconds = divmod(int(self.seconds[id]), 60)
+            return f'{minutes // 60:02d}:{minutes % 60:02d}:{seconds:02d} UTC'
+        if name == 'keywords':
+            return self.vocabulary[self.keyword_ids[self.keyword_offsets[id]:self.keyword_offsets[id + 1]]].tolist()
+        if name in TEXT_FIELDS:
+            return self.texts([id], name)[0]
+        raise KeyError(name)
+
+    def texts(self, ids, field='body'):
+        """Load ``field`` of the articles ``ids`` from the text store."""
+        return self.text_store.get([self.urls[id] for id in ids], field)
+
+    def date_range(self):
+        return EPOCH + timedelta(days=int(self.days.min())), EPOCH + timedelta(days=int(self.days.max()))
+
+    def select(self, search=None, sources=None, sentiments=None, start_date=None, end_date=None):
+        """Ids of the articles matching the filters; ``search`` is looked up in titles and bodies."""
+        mask = np.ones(len(self), dtype=bool)
+        if sources is not None:
+            mask &= np.isin(self.source_codes, self._codes(self.sources, sources))
+        if sentiments is not None:
+            mask &= np.isin(self.sentiment_codes, self._codes(self.sentiment_categories, sentiments))
+        if start_date is not None:
+            mask &= self.days >= (self._date(start_date) - EPOCH).days
+        if end_date is not None:
+            mask &= self.days <= (self._date(end_date) - EPOCH).days
+        if search:
+            search = search.lower()
+            in_body = self.text_store.search(search)
+            mask &= np.array([search in title.lower() or url in in_body
+                              for title, url in zip(self.titles, self.urls)], dtype=bool)
+        return np.flatnonzero(mask)
+
+    def frame(self, ids, texts=()):
+        """DataFrame of the articles ``ids``, indexed by id, with the ``texts`` fields loaded."""
+        ids = np.asarray(ids, dtype=np.int64)
+        frame = pd.DataFrame({
+            'url': [self.urls[id] for id in ids],
+            'title': [self.titles[id] for id in ids],
+            'source': np.array(self.sources, dtype=object)[self.source_codes[ids]],
+            'date': [(EPOCH + timedelta(days=int(days))).isoformat() for days in self.days[ids]],
+            'sentiment': self.sentiments[ids],
+            'sentiment_category': np.array(self.sentiment_categories, dtype=object)[self.sentiment_codes[ids]],
+            'keywords': [self.value(id, 'keywords') for id in ids],
+            'image_url': [self.image_urls[id] for id in ids],
+        }, index=pd.Index(ids, name='id'))
+        for field in texts:
+            frame[field] = self.texts(ids, field)
+        return frame
+
+    @staticmethod
+    def _categorize(values, dtype):
+        categories = sorted(set(values))
+        codes = {value: code for code, value in enumerate(categories)}
+        return [sys.intern(value) for value in categories], np.array([codes[value] for value in values], dtype=dtype)
+
+    @staticmethod
+    def _codes(categories, values):
+        return [code for code, category in enumerate(categories) if category in set(values)]
+
+    @staticmethod
+    def _date(value):
+        return value.date() if isinstance(value, datetime) else value
+
+    @staticmethod
+    def _seconds(time_str):
+        try:
+            hours, minutes, seconds = (int(part) for part in time_str[:8].split(':'))
+        except ValueError:
+            return 0
+        return hours * 3600 + minutes * 60 + seconds
@@ -0,0 +1,164 @@
+"""Scrape the feeds in app/sources.json with several worker processes.
+
+The coordinator fills a SQLite work queue with one task per feed, workers
+lease feeds from it until it is empty, and the coordinator then merges the
+scraped articles into article_cache.json:
+
+    python distributed_scrape.py run --workers 4
+
+Workers can also be started separately, on any host that shares the queue
+file and the cache snapshot:
+
+    python distributed_scrape.py enqueue
+    python distributed_scrape.py worker --id worker-1   # once per worker
+    python distributed_scrape.py collect
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from scrapper import SCRAPE_BUDGET_SECONDS, CacheManager, Scraper, prioritized_feeds, process_articles
+from fetch_guard import FetchGuard
+from image_cache import ImageCache
+from work_queue import QUEUE_FILE, WorkQueue
+from feed_schedule import FeedSchedule
+from analysis_cache import AnalysisCache
+from url_canonical import UrlCanonicalizer, migrate_cache
+from related_index import RelatedArticlesIndex
+from rollups import MetricRollups
+
+SOURCES_FILE = 'app/sources.json'
+
+class QueueCacheManager:
+    """Cache used by workers: read from the cache snapshot, write to the shared queue."""
+
+    def __init__(self, queue, worker, cache_file='article_cache.json'):
+        self.queue = queue
+        self.worker = worker
+        self.cache = {}
+        if os.path.exists(cache_file):
+            with open(cache_file, 'r') as f:
+                self.cache = json.load(f)
+
+    def get_article(self, url):
+        return self.cache.get(url) or self.queue.get_article(url)
+
+    def add_article(self, url, article_data):
+        logging.info(f'Adding article to queue: {url}')
+        self.queue.add_article(url, article_data, self.worker)
+
+    def claim_url(self, url):
+        return self.queue.claim_url(url, self.worker)
+
+def adaptive_polling():
+    return os.getenv('ADAPTIVE_POLLING', '1') == '1'
+
+def enqueue(queue_file):
+    with open(SOURCES_FILE, 'r') as file:
+        sources = json.load(file)
+    # Only feeds that are due get a task in this run, those with the most new entries first
+    schedule = FeedSchedule() if adaptive_polling() else None
+    feeds = prioritized_feeds(sources, schedule)
+    if schedule is not None:
+        # Keep the skips of this run, collect records the polls
+        schedule.save_schedule()
+    # Workers look articles up in the cache snapshot by canonical url
+    migrate_cache(CacheManager(), UrlCanonicalizer(resolve=False), RelatedArticlesIndex(), MetricRollups())
+    queue = WorkQueue(queue_file)
+    queue.enqueue(feeds)
+    queue.close()
+
+def work(queue_file, worker):
+    """Scrape leased feeds until the queue has nothing left to hand out or the budget is used up."""
+    deadline = time.time() + SCRAPE_BUDGET_SECONDS if SCRAPE_BUDGET_SECONDS else None
+    days_to_scrape = int(os.getenv('DAYS_TO_SCRAPE', 7))
+    queue = WorkQueue(queue_file)
+    image_cache = ImageCache() if os.getenv('PREFETCH_IMAGES', '1') == '1' else None
+    analysis_cache = AnalysisCache()
+    canonicalizer = UrlCanonicalizer()
+    guard = FetchGuard()
+    scraper = Scraper({}, days_to_scrape, QueueCacheManager(queue, worker), image_cache,
+                      analysis_cache=analysis_cache, canonicalizer=canonicalizer, guard=guard)
+    seen_urls = set()
+    feeds = 0
+    while True:
+        if deadline is not None and time.time() > deadline:
+            logging.warning(f'Worker {worker} used up its scrape budget, leaving the remaining feeds pending')
+            break
+        task = queue.claim_feed(worker)
+        if task is None:
+            break
+        source, feed_url = task
+        try:
+            _, new_articles, poll = scraper.scrape_feed(source, feed_url, seen_urls=seen_urls, deadline=deadline)
+        except Exception as e:
+            logging.error(f'Worker {worker} failed on feed {feed_url}: {e}')
+            queue.release_feed(feed_url, worker)
+            continue
+        queue.complete_feed(feed_url, worker, new_articles, poll)
+        feeds += 1
+    logging.info(f'Worker {worker} finished after {feeds} feeds')
+    analysis_cache.save_cache()
+    canonicalizer.save_redirects()
+    guard.save_guard()
+    queue.close()
+
+def collect(queue_file):
+    """Merge the articles scraped by all workers into the cache."""
+    queue = WorkQueue(queue_file)
+    progress = queue.progress()
+    if set(progress) - {'done'}:
+        logging.warning(f'Collecting an unfinished run: {progress}')
+    for worker, feeds, new_articles in queue.worker_stats():
+        print(f'{worker}: {feeds} feeds, {new_articles or 0} new articles')
+    if adaptive_polling():
+        # Workers do not share the schedule file, their polls are recorded here
+        schedule = FeedSchedule()
+        for feed_url, new_entries, total_entries, polled_at in queue.polled_feeds():
+            schedule.record_poll(feed_url, new_entries, total_entries, polled_at)
+        schedule.save_schedule()
+    articles = queue.articles()
+    queue.close()
+    if not articles:
+        logging.warning('No articles were scraped.')
+        return
+    cache_manager = CacheManager()
+    process_articles(articles, cache_manager)
+
+def run(queue_file, workers):
+    start_time = time.time()
+    enqueue(queue_file)
+    processes = [subprocess.Popen([sys.executable, __file__, 'worker', '--queue', queue_file,
+                                   '--id', f'{socket.gethostname()}-{i}'])
+                 for i in range(workers)]
+    for process in processes:
+        process.wait()
+    scrape_duration = time.time() - start_time
+    collect(queue_file)
+    print(f'Scraped with {workers} workers in {scrape_duration:.2f} seconds, '
+          f'{time.time() - start_time:.2f} seconds including collection')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['run', 'enqueue', 'worker', 'collect'])
+    parser.add_argument('--queue', default=QUEUE_FILE, help='SQLite queue file shared by all processes')
+    parser.add_argument('--workers', type=int, default=4, help='number of local workers for run')
+    parser.add_argument('--id', default=f'{socket.gethostname()}-{os.getpid()}', help='worker name')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(args.queue, args.workers)
+    elif args.command == 'enqueue':
+        enqueue(args.queue)
+    elif args.command == 'worker':
+        work(args.queue, args.id)
+    else:
+        collect(args.queue)
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,35 @@
 #!/bin/sh
 
-echo "Running the scrapper script..."
-python scrapper.py
+# BOOT_MODE=snapshot (default) serves the last scraped snapshot right away and
+# refreshes it in the background; BOOT_MODE=full scrapes and clusters first.
+# Either way the snapshot is refreshed again whenever the feed schedule has
+# feeds due, for as long as the container runs.
+BOOT_MODE="${BOOT_MODE:-snapshot}"
 
-echo "Running the clustering script..."
-python clustering.py
+refresh() {
+    echo "Running the scrapper script..."
+    python scrapper.py
+
+    echo "Running the clustering script..."
+    python clustering.py
+}
+
+refresh_loop() {
+    while true; do
+        wait_seconds=$(python feed_schedule.py --wait)
+        echo "Next refresh in ${wait_seconds} seconds"
+        sleep "${wait_seconds}"
+        refresh
+    done
+}
+
+if [ "$BOOT_MODE" = "snapshot" ] && [ -s article_cache.json ]; then
+    echo "Serving from the last snapshot, refreshing in the background..."
+    { refresh; refresh_loop; } > refresh.log 2>&1 &
+else
+    refresh
+    refresh_loop > refresh.log 2>&1 &
+fi
 
 echo "Starting the Streamlit app..."
 exec streamlit run main_page.py "$@"
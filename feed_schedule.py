@@ -0,0 +1,131 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+SCHEDULE_FILE = 'feed_schedule.json'
+MIN_INTERVAL = 15 * 60
+MAX_INTERVAL = 24 * 60 * 60
+# Interval used until a feed has been polled twice
+DEFAULT_INTERVAL = int(os.getenv('FIXED_POLL_INTERVAL', 60 * 60))
+# Aim to find about this many new entries per poll
+TARGET_NEW_PER_POLL = 5
+# Weight of the latest poll in the smoothed arrival rate
+RATE_SMOOTHING = 0.3
+# A poll where nearly every entry is new may have missed some, so poll sooner
+SATURATED_RATIO = 0.9
+
+class FeedSchedule:
+    """Per-feed polling schedule adapted to how fast each feed publishes.
+
+    Every poll records how many of the feed's entries were new. The
+    smoothed arrival rate sets the next poll so that a poll finds about
+    TARGET_NEW_PER_POLL new entries: busy feeds are polled every few
+    minutes, quiet ones down to once a day. Runs that skip a feed because
+    it is not due yet count the skip, which is what the report calls saved.
+    """
+
+    def __init__(self, schedule_file=SCHEDULE_FILE):
+        self.schedule_file = schedule_file
+        self.load_schedule()
+
+    def load_schedule(self):
+        if os.path.exists(self.schedule_file):
+            with open(self.schedule_file, 'r') as f:
+                self.feeds = json.load(f)
+        else:
+            self.feeds = {}
+
+    def save_schedule(self):
+        logging.info("Saving feed schedule")
+        tmp_file = self.schedule_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.feeds, f, indent=4)
+        os.replace(tmp_file, self.schedule_file)
+
+    def is_due(self, feed_url, now=None):
+        feed = self.feeds.get(feed_url)
+        return feed is None or (now or time.time()) >= feed['next_poll']
+
+    def record_skip(self, feed_url):
+        """Count a run that left ``feed_url`` alone because it was not due."""
+        feed = self.feeds[feed_url]
+        feed['skipped'] = feed.get('skipped', 0) + 1
+
+    def expected_new_entries(self, feed_url, now=None):
+        """New entries a poll of ``feed_url`` should find now; feeds never polled come first."""
+        feed = self.feeds.get(feed_url)
+        if feed is None or not feed['last_polled']:
+            return float('inf')
+        return (feed['rate_per_hour'] or 0.0) * ((now or time.time()) - feed['last_polled']) / 3600
+
+    def record_poll(self, feed_url, new_entries, total_entries=None, now=None):
+        """Update the arrival rate of ``feed_url`` and schedule its next poll."""
+        now = now or time.time()
+        feed = self.feeds.get(feed_url)
+        if feed is None:
+            feed = self.feeds[feed_url] = {'first_polled': now, 'last_polled': None, 'polls': 0,
+                                           'rate_per_hour': None, 'new_ratio': None, 'interval': DEFAULT_INTERVAL}
+
+        elapsed = now - feed['last_polled'] if feed['last_polled'] else None
+        if elapsed:
+            # The first poll only tells us what the feed holds, not how fast it grows
+            rate = new_entries / (elapsed / 3600)
+            previous = feed['rate_per_hour']
+            feed['rate_per_hour'] = rate if previous is None else RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * previous
+        if total_entries:
+            feed['new_ratio'] = new_entries / total_entries
+
+        if feed['rate_per_hour']:
+            interval = TARGET_NEW_PER_POLL / feed['rate_per_hour'] * 3600
+        elif elapsed:
+            # Nothing new so far, back off
+            interval = feed['interval'] * 2
+        else:
+            interval = DEFAULT_INTERVAL
+        if elapsed and feed['new_ratio'] is not None and feed['new_ratio'] >= SATURATED_RATIO:
+            interval = min(interval, elapsed / 2)
+
+        feed['interval'] = min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+        feed['last_polled'] = now
+        feed['next_poll'] = now + feed['interval']
+        feed['polls'] += 1
+        logging.info(f'Feed {feed_url}: {new_entries} new entries, next poll in {feed["interval"] / 60:.0f} minutes')
+
+    def seconds_until_next_poll(self, now=None):
+        """Seconds until the earliest feed is due, at least MIN_INTERVAL; None if no feed was polled yet."""
+        if not self.feeds:
+            return None
+        # Feeds left due by a failed or cut-short poll would otherwise refresh in a tight loop
+        return max(min(feed['next_poll'] for feed in self.feeds.values()) - (now or time.time()), MIN_INTERVAL)
+
+    def report(self):
+        """Rows of (feed, polls, runs that skipped it, interval in minutes, rate per hour)."""
+        return [(feed_url, feed['polls'], feed.get('skipped', 0), feed['interval'] / 60, feed['rate_per_hour'] or 0.0)
+                for feed_url, feed in sorted(self.feeds.items())]
+
+def print_report(schedule):
+    rows = schedule.report()
+    if not rows:
+        print('No polls recorded yet')
+        return
+    print(f'{"feed":<60} {"polls":>6} {"skipped":>8} {"interval":>9} {"new/h":>7}')
+    for feed_url, polls, skipped, interval, rate in rows:
+        print(f'{feed_url[:60]:<60} {polls:>6} {skipped:>8} {interval:>7.0f}m {rate:>7.2f}')
+    polls = sum(row[1] for row in rows)
+    skipped = sum(row[2] for row in rows)
+    # Without the schedule every run fetches every feed
+    print(f'{polls} feed requests vs {polls + skipped} if every run fetched every feed '
+          f'({skipped / (polls + skipped):.0%} saved)')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report the feed schedule.')
+    parser.add_argument('--wait', action='store_true', help='print the seconds until the next refresh is due')
+    args = parser.parse_args()
+    if args.wait:
+        schedule = FeedSchedule() if os.getenv('ADAPTIVE_POLLING', '1') == '1' else None
+        wait = schedule.seconds_until_next_poll() if schedule is not None else None
+        print(int(wait if wait is not None else DEFAULT_INTERVAL))
+    else:
+        print_report(FeedSchedule())
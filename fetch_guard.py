@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import time
+from urllib.parse import urlsplit
+from shared_json import update_json
+
+GUARD_FILE = 'fetch_guard.json'
+# Consecutive failures after which a host is skipped, and for how long
+FAILURE_THRESHOLD = int(os.getenv('HOST_FAILURE_THRESHOLD', 3))
+COOLDOWN_SECONDS = int(os.getenv('HOST_COOLDOWN_SECONDS', 10 * 60))
+# How long a url that failed to download is not tried again
+FAILED_URL_TTL = int(os.getenv('FAILED_URL_TTL', 6 * 60 * 60))
+
+class FetchGuard:
+    """Per-host circuit breakers and a negative cache of failed urls.
+
+    A host whose downloads fail FAILURE_THRESHOLD times in a row is skipped
+    for COOLDOWN_SECONDS. After that a single trial request is let through:
+    if it succeeds the host is closed again, otherwise it stays open for
+    another cooldown. Failed urls are not retried for FAILED_URL_TTL even
+    when their host is healthy. The state is kept in ``fetch_guard.json``
+    between runs.
+    """
+
+    def __init__(self, guard_file=GUARD_FILE):
+        self.guard_file = guard_file
+        self.load_guard()
+
+    def load_guard(self):
+        self.hosts = {}
+        self.failed_urls = {}
+        if os.path.exists(self.guard_file):
+            with open(self.guard_file, 'r') as f:
+                data = json.load(f)
+            self.hosts = data['hosts']
+            self.failed_urls = data['failed_urls']
+        self.changed_hosts = set()
+        self.new_failed_urls = {}
+
+    def save_guard(self):
+        now = time.time()
+
+        def merge(data):
+            data['hosts'].update({host: self.hosts[host] for host in self.changed_hosts})
+            data['failed_urls'].update(self.new_failed_urls)
+            data['failed_urls'] = {url: failed_at for url, failed_at in data['failed_urls'].items()
+                                   if now - failed_at < FAILED_URL_TTL}
+
+        data = update_json(self.guard_file, merge, {'hosts': {}, 'failed_urls': {}}, indent=4)
+        self.hosts = data['hosts']
+        self.failed_urls = data['failed_urls']
+        self.changed_hosts = set()
+        self.new_failed_urls = {}
+
+    @staticmethod
+    def host(url):
+        return (urlsplit(url).hostname or '').lower()
+
+    def allow(self, url, now=None):
+        """Return False if ``url`` failed recently or its host is open."""
+        now = now or time.time()
+        failed_at = self.failed_urls.get(url)
+        if failed_at is not None and now - failed_at < FAILED_URL_TTL:
+            return False
+        state = self.hosts.get(self.host(url))
+        if state is None or state['open_until'] is None:
+            return True
+        if now < state['open_until']:
+            return False
+        # Cooldown is over, let one trial request through
+        state['open_until'] = now + COOLDOWN_SECONDS
+        self._changed(url)
+        return True
+
+    def record_success(self, url):
+        state = self.hosts.get(self.host(url))
+        if state is not None and (state['failures'] or state['open_until']):
+            if state['open_until']:
+                logging.info(f'Host {self.host(url)} recovered, closing its circuit')
+            state.update(failures=0, open_until=None)
+            self._changed(url)
+
+    def record_failure(self, url, error=None, remember_url=True, now=None):
+        """Count a failed download from the host of ``url``; feeds pass remember_url=False to be retried next run."""
+        now = now or time.time()
+        if remember_url:
+            self.failed_urls[url] = self.new_failed_urls[url] = now
+        state = self.hosts.setdefault(self.host(url), {'failures': 0, 'open_until': None})
+        state['failures'] += 1
+        if state['failures'] >= FAILURE_THRESHOLD:
+            state['open_until'] = now + COOLDOWN_SECONDS
+            logging.warning(f'Host {self.host(url)} failed {state["failures"]} times in a row ({error}), '
+                            f'skipping it for {COOLDOWN_SECONDS} seconds')
+        self._changed(url)
+
+    def _changed(self, url):
+        self.changed_hosts.add(self.host(url))
@@ -0,0 +1,188 @@
+import fcntl
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import requests
+from PIL import Image
+
+IMAGE_CACHE_DIR = 'image_cache'
+THUMBNAIL_SIZE = (640, 360)
+MAX_CACHE_BYTES = int(os.getenv('IMAGE_CACHE_MAX_MB', 200)) * 1024 * 1024
+FETCH_TIMEOUT = 10
+# Threads downloading the images pages asked for in the background
+BACKGROUND_FETCHERS = 2
+USER_AGENT = 'Mozilla/5.0 (compatible; GikiNews/1.0)'
+
+class ImageCache:
+    """Disk cache of resized article images.
+
+    Thumbnails are stored under the SHA-256 of their encoded bytes, so the
+    same picture used by several articles is kept once. ``index.json`` maps
+    each source url to its thumbnail and the original dimensions. Files are
+    touched when served and the least recently used ones are evicted once
+    the cache grows past ``max_bytes``. Pages never wait for a download:
+    a missing thumbnail is fetched in the background while the page shows
+    the original url. Scraper worker processes may share the directory:
+    updates to the index hold an exclusive lock on ``index.lock``.
+    """
+
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_file = os.path.join(cache_dir, 'index.json')
+        self.lock_file = os.path.join(cache_dir, 'index.lock')
+        self.lock = threading.Lock()
+        self.failed = set()
+        self.pending = set()
+        self.executor = None
+        os.makedirs(cache_dir, exist_ok=True)
+        self.load_index()
+
+    def load_index(self):
+        if os.path.exists(self.index_file):
+            self.index_mtime = os.path.getmtime(self.index_file)
+            with open(self.index_file, 'r') as f:
+                self.index = json.load(f)
+        else:
+            self.index_mtime = None
+            self.index = {}
+
+    def index_changed(self):
+        mtime = os.path.getmtime(self.index_file) if os.path.exists(self.index_file) else None
+        return mtime != self.index_mtime
+
+    def save_index(self):
+        tmp_file = f'{self.index_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_file, self.index_file)
+
+    def thumbnail_path(self, url):
+        """Return the cached thumbnail for ``url`` and mark it as recently used."""
+        entry = self.index.get(url)
+        if not entry and self.index_changed():
+            # Thumbnails prefetched by the scraper since the index was loaded
+            self.load_index()
+            entry = self.index.get(url)
+        if not entry:
+            return None
+        path = os.path.join(self.cache_dir, entry['file'])
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def fetch(self, url):
+        """Download ``url`` once, store its thumbnail and return the thumbnail path."""
+        path = self.thumbnail_path(url)
+        if path or not url or url in self.failed:
+            return path
+        try:
+            response = requests.get(url, timeout=FETCH_TIMEOUT, headers={'User-Agent': USER_AGENT})
+            response.raise_for_status()
+            image = Image.open(io.BytesIO(response.content))
+            width, height = image.size
+            image = image.convert('RGB')
+            image.thumbnail(THUMBNAIL_SIZE)
+            data, extension = self._encode(image)
+        except Exception as e:
+            logging.error(f'Error fetching image {url}: {e}')
+            self.failed.add(url)
+            return None
+
+        file_name = hashlib.sha256(data).hexdigest() + extension
+        path = os.path.join(self.cache_dir, file_name)
+        with self.lock, self.locked_index():
+            # Pick up thumbnails stored meanwhile by the scraper, another worker or another session
+            self.load_index()
+            if not os.path.exists(path):
+                tmp_file = f'{path}.{os.getpid()}.tmp'
+                with open(tmp_file, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_file, path)
+            self.index[url] = {'file': file_name, 'width': width, 'height': height}
+            self.evict()
+            self.save_index()
+        return path
+
+    def image_source(self, url):
+        """What to hand to ``st.image``: the local thumbnail, or the original url until it is fetched."""
+        path = self.thumbnail_path(url)
+        if path:
+            return path
+        if url and url not in self.failed:
+            self.fetch_later(url)
+        return url
+
+    def fetch_later(self, url):
+        """Fetch ``url`` on a background thread, once even if several reruns ask for it."""
+        with self.lock:
+            if url in self.pending:
+                return
+            self.pending.add(url)
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=BACKGROUND_FETCHERS, thread_name_prefix='image-cache')
+        self.executor.submit(self._fetch_pending, url)
+
+    def _fetch_pending(self, url):
+        try:
+            self.fetch(url)
+        finally:
+            with self.lock:
+                self.pending.discard(url)
+
+    @contextmanager
+    def locked_index(self):
+        """Hold the lock on the index shared with other processes."""
+        with open(self.lock_file, 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def evict(self):
+        stats = []
+        for name in os.listdir(self.cache_dir):
+            if name.startswith('index.') or name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Touched or evicted by another session meanwhile
+                continue
+            stats.append((stat.st_mtime, stat.st_size, path))
+        stats.sort()
+        total = sum(size for _, size, _ in stats)
+        evicted = set()
+        for _, size, path in stats:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            evicted.add(os.path.basename(path))
+            total -= size
+        if evicted:
+            logging.info(f'Evicted {len(evicted)} thumbnails from image cache')
+            self.index = {url: entry for url, entry in self.index.items() if entry['file'] not in evicted}
+
+    @staticmethod
+    def _encode(image):
+        buffer = io.BytesIO()
+        try:
+            image.save(buffer, format='WEBP', quality=80)
+            return buffer.getvalue(), '.webp'
+        except (KeyError, OSError):
+            # Pillow built without WebP support
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=80, optimize=True)
+            return buffer.getvalue(), '.jpg'
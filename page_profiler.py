@@ -0,0 +1,186 @@
+"""Opt-in profiling of Streamlit page reruns.
+
+Start the app with PAGE_PROFILE=1, or add ?profile=1 to a page url, to get a
+sidebar panel with the wall time and memory of every phase of the page
+script on each rerun. With PAGE_PROFILE=cprofile or pyinstrument the whole
+rerun is also profiled and written to profiles/ for offline analysis:
+
+    python -m pstats profiles/main_page-20240701-120000.prof
+
+?profile=cprofile / ?profile=pyinstrument only write profiles when the app
+was started with PAGE_PROFILE_DUMPS=1; only the newest MAX_PROFILE_DUMPS
+files are kept. Memory is measured with tracemalloc, which runs while at
+least one profiled rerun is in progress and slows the whole process down.
+"""
+import cProfile
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+import pandas as pd
+import streamlit as st
+
+PROFILE_DIR = 'profiles'
+# Reruns listed in the history table of the panel
+HISTORY_RERUNS = 20
+# Profiles kept in PROFILE_DIR, older ones are deleted
+MAX_PROFILE_DUMPS = 50
+DUMP_MODES = ('cprofile', 'pyinstrument')
+
+# Profiled reruns in progress; tracemalloc is on while there is any
+_tracing = {'reruns': 0, 'started': False}
+_tracing_lock = threading.Lock()
+
+def profile_mode():
+    """'' when profiling is off, else '1', 'cprofile' or 'pyinstrument'."""
+    mode = st.query_params.get('profile') or os.getenv('PAGE_PROFILE', '')
+    if mode in DUMP_MODES and mode != os.getenv('PAGE_PROFILE') and os.getenv('PAGE_PROFILE_DUMPS') != '1':
+        # Visitors may not make the server write profiles unless the operator allowed it
+        mode = '1'
+    return '' if mode == '0' else mode
+
+def _start_tracing():
+    with _tracing_lock:
+        if _tracing['reruns'] == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing['started'] = True
+        _tracing['reruns'] += 1
+
+def _stop_tracing():
+    with _tracing_lock:
+        _tracing['reruns'] -= 1
+        # Only stop tracing started here, not tracing enabled with PYTHONTRACEMALLOC
+        if _tracing['reruns'] == 0 and _tracing['started']:
+            tracemalloc.stop()
+            _tracing['started'] = False
+
+class PageProfiler:
+    """Wall time and memory of the phases of one page rerun.
+
+    Pages run their script inside ``with PageProfiler(page) as profiler:``
+    and call ``phase(name)`` where each phase starts. Leaving the block
+    shows the panel, or only stops profiling when the rerun was interrupted.
+    Everything is a no-op unless profiling is enabled.
+    """
+
+    def __init__(self, page, mode=None):
+        self.page = page
+        self.mode = profile_mode() if mode is None else mode
+        self.enabled = bool(self.mode)
+        self.phases = []
+        self.current = None
+        self.profiler = None
+        self.running = False
+        if not self.enabled:
+            return
+
+        _start_tracing()
+        self.running = True
+        self.start_time = time.perf_counter()
+        self.start_memory = tracemalloc.get_traced_memory()[0]
+        if self.mode == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                logging.warning('pyinstrument is not installed, profiling with cProfile')
+                self.mode = 'cprofile'
+            else:
+                self.profiler = Profiler()
+                self.profiler.start()
+        if self.mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Streamlit interrupts reruns with exceptions, profiling must stop then too
+        if exc_type is None:
+            self.finish()
+        else:
+            self.stop(dump=False)
+        return False
+
+    def phase(self, name):
+        """End the running phase and start timing ``name``."""
+        if not self.running:
+            return
+        self._end_phase()
+        tracemalloc.reset_peak()
+        self.current = (name, time.perf_counter(), tracemalloc.get_traced_memory()[0])
+
+    def stop(self, dump=True):
+        """End the last phase and stop measuring; returns the profile file written if ``dump``."""
+        if not self.running:
+            return None
+        self.running = False
+        self._end_phase()
+        self.total = time.perf_counter() - self.start_time
+        self.memory = (tracemalloc.get_traced_memory()[0] - self.start_memory) / 2 ** 20
+        _stop_tracing()
+        if self.profiler is not None:
+            if self.mode == 'pyinstrument':
+                self.profiler.stop()
+            else:
+                self.profiler.disable()
+        return self._dump() if dump else None
+
+    def finish(self):
+        """Stop profiling and show the sidebar panel."""
+        if not self.running:
+            return
+        dump_file = self.stop()
+        total = self.total
+        memory = self.memory
+        logging.info(f'Profiled rerun of {self.page}: {total:.2f} seconds, '
+                     + ', '.join(f'{p["phase"]} {p["seconds"]:.2f}' for p in self.phases))
+
+        history = st.session_state.setdefault('page_profile_history', [])
+        history.append({'page': self.page, 'at': datetime.now().strftime('%H:%M:%S'), 'seconds': round(total, 3)})
+        del history[:-HISTORY_RERUNS]
+
+        with st.sidebar.expander('Profile', expanded=True):
+            st.write(f'Rerun took {total:.2f} s, memory {memory:+.1f} MB')
+            st.dataframe(pd.DataFrame(self.phases).round(3), hide_index=True)
+            st.caption('Last reruns')
+            st.dataframe(pd.DataFrame(history[::-1]), hide_index=True)
+            if dump_file:
+                st.caption(f'Profile written to {dump_file}')
+
+    def _end_phase(self):
+        if self.current is None:
+            return
+        name, start, memory = self.current
+        current, peak = tracemalloc.get_traced_memory()
+        self.phases.append({'phase': name, 'seconds': time.perf_counter() - start,
+                            'memory_mb': (current - memory) / 2 ** 20, 'peak_mb': (peak - memory) / 2 ** 20})
+        self.current = None
+
+    def _dump(self):
+        if self.profiler is None:
+            return None
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = os.path.splitext(os.path.basename(self.page))[0]
+        path = os.path.join(PROFILE_DIR, f'{name}-{datetime.now().strftime("%Y%m%d-%H%M%S")}')
+        if self.mode == 'pyinstrument':
+            path += '.html'
+            with open(path, 'w') as f:
+                f.write(self.profiler.output_html())
+        else:
+            path += '.prof'
+            self.profiler.dump_stats(path)
+        self.profiler = None
+        self._prune_dumps()
+        return path
+
+    @staticmethod
+    def _prune_dumps():
+        dumps = sorted((entry.stat().st_mtime, entry.path) for entry in os.scandir(PROFILE_DIR) if entry.is_file())
+        for _, path in dumps[:-MAX_PROFILE_DUMPS]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,59 @@
+"""Process-wide resources of the Streamlit pages.
+
+Every page imports its loaders from here, so the pages of one server share
+a single cached copy of each resource instead of one per page. Loaders
+take the mtime of their file as part of the cache key and keep only the
+latest entry, so a refreshed file replaces the old copy.
+"""
+import os
+import streamlit as st
+from corpus import Corpus
+from clustering import compute_tfidf_matrix, cluster_tfidf
+from cluster_summary import summarize_clusters
+from image_cache import ImageCache
+from related_index import RelatedArticlesIndex, RELATED_INDEX_FILE
+from rollups import ROLLUPS_FILE, MetricRollups
+
+def file_mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+@st.cache_resource(max_entries=1)
+def load_corpus(cache_file, mtime):
+    # mtime is only part of the cache key so a refreshed cache is picked up
+    return Corpus.from_cache(cache_file)
+
+@st.cache_resource(max_entries=4)
+def cluster_articles(version, ids, _corpus):
+    # The corpus version and the selected ids are the cache key, reruns with the same filters reuse the clusters
+    news_df = _corpus.frame(ids)
+    news_df['cluster_id'] = cluster_tfidf(compute_tfidf_matrix(news_df, lambda ids: _corpus.texts(ids, 'clean_body')))
+    return news_df, summarize_clusters(news_df)
+
+@st.cache_resource
+def get_image_cache():
+    return ImageCache()
+
+@st.cache_resource(max_entries=1)
+def load_related_index(index_file, mtime):
+    return RelatedArticlesIndex(index_file)
+
+def display_related_articles(url, k=3):
+    """List the articles most similar to ``url`` under its card."""
+    if not url or not os.path.exists(RELATED_INDEX_FILE):
+        return
+    index = load_related_index(RELATED_INDEX_FILE, file_mtime(RELATED_INDEX_FILE))
+    related = index.related(url, k)
+    if related:
+        st.markdown("**More like this:**\n" + "\n".join(f"- [{title}]({related_url})" for related_url, title, _ in related))
+
+@st.cache_resource(max_entries=1)
+def _load_rollups(rollups_file, mtime, _load_articles):
+    rollups = MetricRollups(rollups_file)
+    if not rollups.exists():
+        # No current rollups were saved yet, count the loaded articles once
+        rollups.rebuild(_load_articles())
+    return rollups
+
+def load_rollups(load_articles, rollups_file=ROLLUPS_FILE):
+    """The metric rollups; ``load_articles`` returns the article dicts to count if there are none yet."""
+    return _load_rollups(rollups_file, file_mtime(rollups_file), load_articles)
@@ -1,17 +1,14 @@
-import pandas as pd
+import os
 import streamlit as st
-import json
-import toml
-from datetime import datetime
-from clustering import compute_tfidf
-from sklearn.cluster import AgglomerativeClustering
-from collections import Counter
+from app_config import load_config
+from page_resources import cluster_articles, display_related_articles, get_image_cache, load_corpus
+from page_profiler import PageProfiler
 
 # PAGE FORMAT
 st.set_page_config(layout='wide', initial_sidebar_state='expanded')
 
 # Load configuration from TOML file
-config = toml.load('config.toml')
+config = load_config()
 
 # Header for the Streamlit app
 st.title('Giki News for People in a Hurry!')
@@ -19,114 +16,95 @@ st.title('Giki News for People in a Hurry!')
 # Load the JSON file with article data
 file_path = 'article_cache.json'
 
-@st.cache_data
-def load_data():
-    with open(file_path, 'r') as f:
-        data = json.load(f)
-    return data
-
-# Load the data from the JSON file
-original_data = load_data()
-
-# Convert dates to datetime objects for filtering
-for article in original_data.values():
-    article['date'] = datetime.strptime(article['date'], '%Y-%m-%d')
-
-# Extract necessary data from the loaded JSON
-articles = list(original_data.values())
-
-# Sidebar filters
-st.sidebar.header('Filters')
-search_topic = st.sidebar.text_input("Search for a topic")
-selected_sentiment = st.sidebar.multiselect(
-    "Select Sentiment Category",
-    options=list(set(article['sentiment_category'] for article in articles)),
-    default=list(set(article['sentiment_category'] for article in articles))
-)
-all_sources = list(set(article['source'] for article in articles))
-selected_sources = st.sidebar.multiselect(
-    "Select Sources",
-    options=all_sources,
-    default=[]
-)
-
-# Get the date range for the slider
-min_date = min(article['date'] for article in articles)
-max_date = max(article['date'] for article in articles)
-
-# Date range slider
-start_date, end_date = st.sidebar.slider(
-    "Select date range",
-    min_value=min_date,
-    max_value=max_date,
-    value=(min_date, max_date),
-    format="YYYY-MM-DD"
-)
-
-# If no sources are selected, use all sources
-if not selected_sources:
-    selected_sources = all_sources
-
-# Filter articles based on the search topic, selected sentiment category, selected sources, and date range
-filtered_articles = [
-    article for article in articles 
-    if (search_topic.lower() in article['title'].lower() or search_topic.lower() in article['body'].lower())
-    and article['sentiment_category'] in selected_sentiment
-    and article['source'] in selected_sources
-    and start_date <= article['date'] <= end_date
-]
-
-# Determine clusters using AgglomerativeClustering
-if len(filtered_articles) == 0:
-    st.write("No articles found")
-else:
-    # Compute TF-IDF values for filtered articles
-    news_df = pd.DataFrame(filtered_articles)
-    tfidf_array = compute_tfidf(news_df)
-    
-    clustering_model = AgglomerativeClustering(n_clusters=None, distance_threshold=1.5)
-    news_df['cluster_id'] = clustering_model.fit_predict(tfidf_array)
-    
-    clusters = {str(cluster_id): news_df[news_df.cluster_id == cluster_id].to_dict(orient='records')
-                for cluster_id in news_df['cluster_id'].unique()}
-    
-    # Calculate most frequent keywords for each cluster
-    cluster_keywords = {}
-    for cluster_id, articles in clusters.items():
-        keywords = [keyword for article in articles for keyword in article.get('keywords', [])]
-        most_common_keywords = [keyword for keyword, _ in Counter(keywords).most_common(3)]
-        cluster_keywords[cluster_id] = most_common_keywords
-
-    # Display clusters with articles
-    st.header("Article Clusters")
-
-    # Sort clusters by cluster number
-    sorted_clusters = sorted(clusters.items())
-
-    for cluster_id, articles in sorted_clusters:
-        # Display cluster number and sample keywords
-        st.subheader(f'Cluster {cluster_id}')
-        cluster_keywords_list = ", ".join(cluster_keywords[cluster_id])
-        st.write(f'**Keywords:** {cluster_keywords_list}')
-        
-        # Display articles in a three-column layout
-        cols = st.columns(3)
-        for idx, article in enumerate(articles[:3]):
-            with cols[idx]:
-                image_url = article.get('image_url', 'https://via.placeholder.com/150')
-                date = article.get('date').strftime('%Y-%m-%d')
-                title = article.get('title', 'No title available')
-                body = article.get('body', 'No body available')
-                sentiment = article.get('sentiment_category', 'No sentiment category available')
-                url = article.get('url', '#')
-
-                # Truncate body to 100 words
-                truncated_body = " ".join(body.split()[:100]) + '...' if len(body.split()) > 100 else body
-
-                # Display article details
-                st.image(image_url, use_column_width=True)
-                st.write(f"Source: {article['source']}")
-                st.write(f"Published on: {date}")
-                st.markdown(f"[**{title}**]({url})")
-                st.write(truncated_body)
-                st.write(f"Sentiment: {sentiment}")
+# Phase timings of this rerun, only recorded with PAGE_PROFILE=1 or ?profile=1
+with PageProfiler('pages/all_clusters.py') as profiler:
+    # Load the compact article corpus, texts stay on disk until needed
+    profiler.phase('load data')
+    corpus = load_corpus(file_path, os.path.getmtime(file_path))
+
+    # Sidebar filters
+    profiler.phase('filter')
+    st.sidebar.header('Filters')
+    search_topic = st.sidebar.text_input("Search for a topic")
+    selected_sentiment = st.sidebar.multiselect(
+        "Select Sentiment Category",
+        options=corpus.sentiment_categories,
+        default=corpus.sentiment_categories
+    )
+    all_sources = corpus.sources
+    selected_sources = st.sidebar.multiselect(
+        "Select Sources",
+        options=all_sources,
+        default=[]
+    )
+
+    # Get the date range for the slider
+    min_date, max_date = corpus.date_range()
+
+    # Date range slider
+    start_date, end_date = st.sidebar.slider(
+        "Select date range",
+        min_value=min_date,
+        max_value=max_date,
+        value=(min_date, max_date),
+        format="YYYY-MM-DD"
+    )
+
+    # If no sources are selected, use all sources
+    if not selected_sources:
+        selected_sources = all_sources
+
+    # Filter articles based on the search topic, selected sentiment category, selected sources, and date range
+    filtered_ids = corpus.select(search=search_topic, sentiments=selected_sentiment, sources=selected_sources,
+                                 start_date=start_date, end_date=end_date)
+
+    # Determine clusters for the filtered articles
+    if len(filtered_ids) == 0:
+        st.write("No articles found")
+    else:
+        # Compute TF-IDF values for filtered articles
+        profiler.phase('cluster')
+        news_df, summary = cluster_articles(corpus.version, filtered_ids, corpus)
+
+        # Only the first three articles of each cluster are displayed, so only their bodies are loaded
+        displayed = news_df.groupby('cluster_id').head(3)
+        records = dict(zip(displayed.index, corpus.records(displayed.index, texts=('body',))))
+        clusters = {str(cluster_id): [records[id] for id in group.index]
+                    for cluster_id, group in displayed.groupby('cluster_id')}
+
+        # Most frequent keywords for each cluster
+        cluster_keywords = {str(cluster_id): keywords for cluster_id, keywords in summary['top_keywords'].items()}
+
+        # Display clusters with articles
+        profiler.phase('render')
+        st.header("Article Clusters")
+
+        # groupby already sorts clusters by cluster number
+        for cluster_id, articles in clusters.items():
+            # Display cluster number and sample keywords
+            st.subheader(f'Cluster {cluster_id}')
+            cluster_keywords_list = ", ".join(cluster_keywords[cluster_id])
+            st.write(f'**Keywords:** {cluster_keywords_list}')
+
+            # Display articles in a three-column layout
+            cols = st.columns(3)
+            for idx, article in enumerate(articles[:3]):
+                with cols[idx]:
+                    image_url = article.get('image_url', 'https://via.placeholder.com/150')
+                    date = article.get('date')
+                    title = article.get('title', 'No title available')
+                    body = article.get('body', 'No body available')
+                    sentiment = article.get('sentiment_category', 'No sentiment category available')
+                    url = article.get('url', '#')
+
+                    # Truncate body to 100 words
+                    truncated_body = " ".join(body.split()[:100]) + '...' if len(body.split()) > 100 else body
+
+                    # Display article details
+                    st.image(get_image_cache().image_source(image_url), use_column_width=True)
+                    st.write(f"Source: {article['source']}")
+                    st.write(f"Published on: {date}")
+                    st.markdown(f"[**{title}**]({url})")
+                    st.write(truncated_body)
+                    st.write(f"Sentiment: {sentiment}")
+                    display_related_articles(url)
@@ -0,0 +1,133 @@
+import logging
+import os
+import numpy as np
+
+RELATED_INDEX_FILE = 'related_index.npz'
+
+# Hashed bag of words, projected down to a small dense vector per article.
+# Everything is seeded so vectors stay comparable across incremental updates.
+N_FEATURES = 2 ** 18
+N_COMPONENTS = 256
+# Random-hyperplane LSH tables used to find candidate neighbours
+N_TABLES = 8
+N_BITS = 12
+SEED = 42
+
+class RelatedArticlesIndex:
+    """Cosine nearest-neighbour index over article bodies for "more like this".
+
+    Articles are embedded once at ingest with a hashing vectorizer followed by
+    a sparse random projection, so adding articles never refits anything.
+    Lookups hash the stored vector of an article into a few LSH tables and
+    rank only the colliding candidates by exact cosine similarity.
+    """
+
+    def __init__(self, index_file=RELATED_INDEX_FILE):
+        self.index_file = index_file
+        self.vectorizer = None
+        self.projection = None
+        self.planes = np.random.default_rng(SEED).standard_normal((N_TABLES, N_BITS, N_COMPONENTS)).astype(np.float32)
+        self.load()
+
+    def load(self):
+        self.urls = []
+        self.titles = []
+        self.vectors = np.empty((0, N_COMPONENTS), dtype=np.float32)
+        if os.path.exists(self.index_file):
+            logging.info("Loading related articles index")
+            with np.load(self.index_file) as data:
+                self.urls = data['urls'].tolist()
+                self.titles = data['titles'].tolist()
+                self.vectors = data['vectors']
+        self.positions = {url: i for i, url in enumerate(self.urls)}
+        self.codes = self._hash(self.vectors)
+        self.buckets = [{} for _ in range(N_TABLES)]
+        self._add_to_buckets(0)
+
+    def save(self):
+        logging.info("Saving related articles index")
+        tmp_file = self.index_file + '.tmp.npz'
+        np.savez(tmp_file, urls=np.array(self.urls, dtype=str), titles=np.array(self.titles, dtype=str), vectors=self.vectors)
+        os.replace(tmp_file, self.index_file)
+
+    def __len__(self):
+        return len(self.urls)
+
+    def embed(self, texts):
+        # Only ingest needs scikit-learn, lookups from the UI stay on numpy
+        if self.vectorizer is None:
+            import scipy.sparse as sp
+            from sklearn.feature_extraction.text import HashingVectorizer
+            from sklearn.random_projection import SparseRandomProjection
+
+            self.vectorizer = HashingVectorizer(n_features=N_FEATURES, alternate_sign=False, norm='l2')
+            self.projection = SparseRandomProjection(n_components=N_COMPONENTS, dense_output=True, random_state=SEED)
+            self.projection.fit(sp.csr_matrix((1, N_FEATURES)))
+        vectors = self.projection.transform(self.vectorizer.transform(texts))
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors.astype(np.float32)
+
+    def add(self, urls, titles, texts):
+        """Embed and index the articles whose url is not indexed yet."""
+        new = [(url, title, text) for url, title, text in zip(urls, titles, texts) if url not in self.positions]
+        if not new:
+            return 0
+        logging.info(f'Adding {len(new)} articles to related articles index')
+        urls, titles, texts = zip(*new)
+        start = len(self.urls)
+        vectors = self.embed(texts)
+        self.urls.extend(urls)
+        self.titles.extend(titles)
+        self.positions.update((url, start + i) for i, url in enumerate(urls))
+        self.vectors = np.vstack([self.vectors, vectors])
+        self.codes = np.vstack([self.codes, self._hash(vectors)])
+        self._add_to_buckets(start)
+        return len(new)
+
+    def rename(self, renamed):
+        """Move articles to the urls in the ``renamed`` mapping, keeping one row per url.
+
+        Returns True if the index changed.
+        """
+        keep = {}
+        for row, url in enumerate(self.urls):
+            keep.setdefault(renamed.get(url, url), row)
+        if len(keep) == len(self.urls) and all(url == self.urls[row] for url, row in keep.items()):
+            return False
+        rows = list(keep.values())
+        self.urls = list(keep)
+        self.titles = [self.titles[row] for row in rows]
+        self.vectors = self.vectors[rows]
+        self.positions = {url: i for i, url in enumerate(self.urls)}
+        self.codes = self._hash(self.vectors)
+        self.buckets = [{} for _ in range(N_TABLES)]
+        self._add_to_buckets(0)
+        return True
+
+    def related(self, url, k=5):
+        """Return up to ``k`` (url, title, similarity) tuples most similar to ``url``."""
+        row = self.positions.get(url)
+        if row is None:
+            return []
+        candidates = set()
+        for table, code in enumerate(self.codes[row]):
+            candidates.update(self.buckets[table].get(code, ()))
+        candidates.discard(row)
+        if len(candidates) < k:
+            # Too few collisions to fill the list, rank everything instead
+            candidates = set(range(len(self.urls))) - {row}
+        if not candidates:
+            return []
+        candidates = np.fromiter(candidates, dtype=np.int64)
+        scores = self.vectors[candidates] @ self.vectors[row]
+        top = np.argsort(-scores)[:k]
+        return [(self.urls[i], self.titles[i], float(s)) for i, s in zip(candidates[top], scores[top])]
+
+    def _hash(self, vectors):
+        bits = np.einsum('tbd,nd->ntb', self.planes, vectors) > 0
+        return bits.astype(np.int64) @ (1 << np.arange(N_BITS, dtype=np.int64))
+
+    def _add_to_buckets(self, start):
+        for row in range(start, len(self.codes)):
+            for table, code in enumerate(self.codes[row]):
+                self.buckets[table].setdefault(code, []).append(row)
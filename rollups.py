@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+from collections import Counter
+import pandas as pd
+from corpus import UNSCORED
+
+ROLLUPS_FILE = 'metric_rollups.json'
+# Bump when what is counted changes, older files are rebuilt from the cache
+ROLLUPS_VERSION = 2
+
+def contribution(article):
+    """Rollup keys an article adds to: one (day, source, sentiment) count and one per keyword."""
+    key = (article['date'], article['source'], article.get('sentiment_category') or UNSCORED)
+    keywords = article.get('keywords')
+    return key, [key + (keyword,) for keyword in keywords] if isinstance(keywords, list) else []
+
+class MetricRollups:
+    """Article and keyword counts per day, source and sentiment for the dashboards.
+
+    The scraper counts articles as it caches them, as unscored, and
+    ``process_articles`` replaces them with their scored versions, so a
+    chart sums a few rollup rows for the selected range instead of
+    recounting every article. Its size grows with days, sources and
+    keywords, not with the number of articles.
+    """
+
+    def __init__(self, rollups_file=ROLLUPS_FILE):
+        self.rollups_file = rollups_file
+        self.load()
+
+    def load(self):
+        self.counts = Counter()
+        self.keywords = Counter()
+        self.current = False
+        if os.path.exists(self.rollups_file):
+            with open(self.rollups_file, 'r') as f:
+                data = json.load(f)
+            if data.get('version') != ROLLUPS_VERSION:
+                logging.info("Metric rollups are outdated and will be rebuilt")
+                self._frames = None
+                return
+            self.current = True
+            self.counts.update({tuple(row[:-1]): row[-1] for row in data['counts']})
+            self.keywords.update({tuple(row[:-1]): row[-1] for row in data['keywords']})
+        self._frames = None
+
+    def exists(self):
+        """Whether counts of the current version were loaded, rather than starting empty."""
+        return self.current
+
+    def save(self):
+        logging.info("Saving metric rollups")
+        tmp_file = self.rollups_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'version': ROLLUPS_VERSION,
+                       'counts': [[*key, n] for key, n in self.counts.items()],
+                       'keywords': [[*key, n] for key, n in self.keywords.items()]}, f)
+        os.replace(tmp_file, self.rollups_file)
+
+    def rebuild(self, articles):
+        self.counts = Counter()
+        self.keywords = Counter()
+        self.update(articles)
+
+    def update(self, articles, previous=()):
+        """Count ``articles``, replacing the counts of the ``previous`` versions of the same articles."""
+        for article in previous:
+            key, keyword_keys = contribution(article)
+            self.counts[key] -= 1
+            self.keywords.subtract(keyword_keys)
+        for article in articles:
+            key, keyword_keys = contribution(article)
+            self.counts[key] += 1
+            self.keywords.update(keyword_keys)
+        # Drop keys whose articles were all replaced
+        self.counts = +self.counts
+        self.keywords = +self.keywords
+        self._frames = None
+
+    def frames(self):
+        if self._frames is None:
+            counts = pd.DataFrame([(*key, n) for key, n in self.counts.items()],
+                                  columns=['date', 'source', 'sentiment', 'count'])
+            keywords = pd.DataFrame([(*key, n) for key, n in self.keywords.items()],
+                                    columns=['date', 'source', 'sentiment', 'keyword', 'count'])
+            self._frames = counts, keywords
+        return self._frames
+
+    def article_counts(self, start=None, end=None, sources=None, sentiments=None):
+        """Rows of (date, source, sentiment, count) in the selected range."""
+        return self._select(self.frames()[0], start, end, sources, sentiments)
+
+    def keyword_counts(self, start=None, end=None, sources=None, sentiments=None):
+        """Series of keyword counts in the selected range, most frequent first."""
+        rows = self._select(self.frames()[1], start, end, sources, sentiments)
+        return rows.groupby('keyword')['count'].sum().sort_values(ascending=False)
+
+    @staticmethod
+    def _select(frame, start, end, sources, sentiments):
+        mask = pd.Series(True, index=frame.index)
+        # Days are ISO strings, so they compare in date order
+        if start is not None:
+            mask &= frame['date'] >= str(start)[:10]
+        if end is not None:
+            mask &= frame['date'] <= str(end)[:10]
+        if sources is not None:
+            mask &= frame['source'].isin(sources)
+        if sentiments is not None:
+            mask &= frame['sentiment'].isin(sentiments)
+        return frame[mask]
@@ -1,27 +1,107 @@
 import feedparser as fp
 import dateutil.parser
 from newspaper import Article, Config
+from newspaper.article import ArticleDownloadState
+import requests
 import logging
 import pandas as pd
 import json
 from datetime import datetime, timedelta, timezone
-from textblob import TextBlob
 import os
 from nltk.corpus import stopwords
 from nltk.stem import SnowballStemmer
 import string
 from nltk.tokenize import word_tokenize
 from unidecode import unidecode
+from related_index import RelatedArticlesIndex
+from rollups import MetricRollups
+from image_cache import ImageCache
+from feed_schedule import FeedSchedule
+from fetch_guard import FetchGuard
+from url_canonical import UrlCanonicalizer, migrate_cache
+from analysis_cache import (
+    NLP_VERSION, AnalysisCache, cached_sentiment, classify_sentiment, get_sentiment_backend,
+)
 import time
 import threading
 import sys
+from email.utils import parsedate_to_datetime
 
 # Set up logging configuration
 logging.basicConfig(filename='scrapper.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Timezone abbreviations seen in feed dates that dateutil cannot resolve on its own
+TZINFOS = {
+    'EDT': timezone(timedelta(hours=-4)),
+    'EST': timezone(timedelta(hours=-5)),
+    'CDT': timezone(timedelta(hours=-5)),
+    'CST': timezone(timedelta(hours=-6)),
+    'MDT': timezone(timedelta(hours=-6)),
+    'MST': timezone(timedelta(hours=-7)),
+    'PDT': timezone(timedelta(hours=-7)),
+    'PST': timezone(timedelta(hours=-8)),
+}
+
+FEED_TIMEOUT = 10
+# Wall-clock limit of a scrape run; feeds left over are polled first next run
+SCRAPE_BUDGET_SECONDS = int(os.getenv('SCRAPE_BUDGET_SECONDS', 30 * 60))
+
+def fetch_feed(url):
+    """Download and parse an RSS feed, with the timeout feedparser itself does not offer."""
+    response = requests.get(url, timeout=FEED_TIMEOUT, headers={'User-Agent': fp.USER_AGENT})
+    response.raise_for_status()
+    headers = {name.lower(): value for name, value in response.headers.items()}
+    return fp.parse(response.content, response_headers={**headers, 'content-location': response.url})
+
+def prioritized_feeds(sources, schedule=None, now=None):
+    """(source, feed url) pairs to poll, the feeds expected to have the most new entries first."""
+    feeds = [(source, url) for source, content in sources.items() for url in content['rss']]
+    if schedule is None:
+        return feeds
+    now = now or time.time()
+    due = []
+    for source, url in feeds:
+        if schedule.is_due(url, now):
+            due.append((source, url))
+        else:
+            schedule.record_skip(url)
+    if len(due) < len(feeds):
+        logging.info(f'Skipping {len(feeds) - len(due)} RSS feeds not due yet')
+    return sorted(due, key=lambda feed: -schedule.expected_new_entries(feed[1], now))
+
+def parse_entry_date(entry):
+    """Return the publication date of a feed entry as an aware UTC datetime.
+
+    Tries feedparser's pre-parsed ``published_parsed`` struct first, then the
+    RFC-822 parser from the standard library, and only falls back to the fuzzy
+    dateutil parser when both fail.
+    """
+    parsed = entry.get('published_parsed')
+    if parsed:
+        return datetime(*parsed[:6], tzinfo=timezone.utc)
+
+    published = entry.get('published')
+    try:
+        article_date = parsedate_to_datetime(published)
+    except (TypeError, ValueError, IndexError):
+        article_date = dateutil.parser.parse(published, tzinfos=TZINFOS)
+
+    if article_date.tzinfo is None:
+        article_date = article_date.replace(tzinfo=timezone.utc)
+    return article_date.astimezone(timezone.utc)
+
+def cached_article_date(article):
+    """Rebuild the UTC publication datetime stored on a cached article."""
+    return datetime.strptime(f"{article['date']} {article['time'][:8]}", '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+def cache_key(article):
+    """Canonical url the cache is keyed by; ``url`` stays the link as published."""
+    return article.get('canonical_url') or article['url']
+
 class CacheManager:
     def __init__(self, cache_file='article_cache.json'):
         self.cache_file = cache_file
+        self.rollups = None
         self.load_cache()
     
     def load_cache(self):
@@ -36,104 +116,86 @@ class CacheManager:
     
     def save_cache(self):
         logging.info("Saving cache")
-        with open(self.cache_file, 'w') as f:
+        # Write to a temporary file and swap it in, the app may be serving
+        # from this file while a background scrape is running
+        tmp_file = self.cache_file + '.tmp'
+        with open(tmp_file, 'w') as f:
             json.dump(self.cache, f, indent=4)
+        os.replace(tmp_file, self.cache_file)
     
     def get_article(self, url):
         return self.cache.get(url, None)
     
     def add_article(self, url, article_data):
         logging.info(f'Adding article to cache: {url}')
+        # Count the article on the dashboards right away, process_articles
+        # replaces it with its scored version
+        rollups = self.article_rollups()
+        previous = self.cache.get(url)
+        rollups.update([article_data], [previous] if previous else [])
         self.cache[url] = article_data
         self.save_cache()
+        rollups.save()
+
+    def add_articles(self, articles):
+        logging.info(f'Adding {len(articles)} articles to cache')
+        for article in articles:
+            self.cache[cache_key(article)] = article
+        self.save_cache()
+
+    def claim_url(self, url):
+        # A single scraper process owns every url it finds
+        return True
+
+    def article_rollups(self):
+        """The metric rollups of the cached articles, rebuilt from the cache if there are none yet."""
+        if self.rollups is None:
+            self.rollups = MetricRollups()
+            if not self.rollups.exists():
+                self.rollups.rebuild(self.cache.values())
+        return self.rollups
 
 class Scraper:
-    def __init__(self, sources, days, cache_manager):
+    def __init__(self, sources, days, cache_manager, image_cache=None, schedule=None, analysis_cache=None,
+                 canonicalizer=None, guard=None, budget_seconds=None):
         self.sources = sources
         self.days = days
         self.cache_manager = cache_manager
+        self.image_cache = image_cache
+        self.schedule = schedule
+        self.analysis_cache = analysis_cache
+        self.canonicalizer = canonicalizer
+        self.guard = guard
+        self.budget_seconds = budget_seconds
 
     def scrape(self):
         start_time = time.time()  # Start time of scraping
+        deadline = start_time + self.budget_seconds if self.budget_seconds else None
         articles_list = []
         new_articles_count = 0
         now = datetime.now(timezone.utc)
+        seen_urls = set()
         
-        # Define a tzinfos dictionary for handling timezone abbreviations
-        tzinfos = {
-            'EDT': timezone(timedelta(hours=-4)),  # Example mapping
-            'EST': timezone(timedelta(hours=-5)),
-            'CDT': timezone(timedelta(hours=-5)),
-            'CST': timezone(timedelta(hours=-6)),
-            'MDT': timezone(timedelta(hours=-6)),
-            'MST': timezone(timedelta(hours=-7)),
-            'PDT': timezone(timedelta(hours=-7)),
-            'PST': timezone(timedelta(hours=-8)),
-        }
-        
-        for source, content in self.sources.items():
+        feeds = prioritized_feeds(self.sources, self.schedule, now.timestamp())
+        for i, (source, url) in enumerate(feeds):
+            if deadline is not None and time.time() > deadline:
+                logging.warning(f'Scrape budget of {self.budget_seconds} seconds used up, '
+                                f'{len(feeds) - i} RSS feeds left for the next run')
+                break
             logging.info(f'Source: {source}')
-            for url in content['rss']:
-                logging.info(f'Processing RSS feed: {url}')
-                try:
-                    d = fp.parse(url)
-                except Exception as e:
-                    logging.error(f'Error parsing RSS feed {url}: {e}')
-                    continue
-                
-                for entry in d.entries:
-                    if not hasattr(entry, 'published'):
-                        logging.warning(f'Entry missing "published" attribute: {entry}')
-                        continue
-                    
-                    try:
-                        article_date = dateutil.parser.parse(getattr(entry, 'published'), tzinfos=tzinfos)
-                        article_date = article_date.astimezone(timezone.utc)
-                        logging.info(f'Found article with date: {article_date}')
-                    except Exception as e:
-                        logging.error(f'Error parsing article date: {e}')
-                        continue
-                    
-                    if now - article_date <= timedelta(days=self.days):
-                        cached_article = self.cache_manager.get_article(entry.link)
-                        if cached_article:
-                            logging.info(f'Using cached article: {entry.link}')
-                            articles_list.append(cached_article)
-                            continue
-                        
-                        try:
-                            logging.info(f'Processing article: {entry.link}')
-                            content = Article(entry.link, config=config)
-                            content.download()
-                            content.parse()
-                            content.nlp()
-                            try:
-                                sentiment = TextBlob(content.text).sentiment.polarity
-                                sentiment_category = 'positive' if sentiment > 0 else 'neutral' if sentiment == 0 else 'negative'
-                                
-                                article = {
-                                    'source': source,
-                                    'url': entry.link,
-                                    'date': article_date.strftime('%Y-%m-%d'),
-                                    'time': article_date.strftime('%H:%M:%S %Z'),
-                                    'title': content.title,
-                                    'body': content.text,
-                                    'summary': content.summary,
-                                    'keywords': content.keywords,
-                                    'image_url': content.top_image,
-                                    'sentiment': sentiment,
-                                    'sentiment_category': sentiment_category
-                                }
-                                
-                                articles_list.append(article)
-                                self.cache_manager.add_article(entry.link, article)
-                                new_articles_count += 1
-                            except Exception as e:
-                                logging.error(f'Error processing article: {e}')
-                                logging.info('Continuing...')
-                        except Exception as e:
-                            logging.error(f'Error downloading/parsing article: {e}')
-                            logging.info('Continuing...')
+            articles, new_articles, poll = self.scrape_feed(source, url, now, seen_urls, deadline)
+            articles_list.extend(articles)
+            new_articles_count += new_articles
+            if self.schedule is not None and poll is not None:
+                self.schedule.record_poll(url, *poll)
+        if self.guard is not None:
+            self.guard.save_guard()
+        if self.schedule is not None:
+            self.schedule.save_schedule()
+        if self.analysis_cache is not None:
+            self.analysis_cache.save_cache()
+        if self.canonicalizer is not None:
+            self.canonicalizer.save_redirects()
         end_time = time.time()  # End time of scraping
         duration = end_time - start_time  # Calculate duration
         logging.info(f'Scraping completed in {duration:.2f} seconds')
@@ -142,6 +204,175 @@ class Scraper:
         print(f'Total new articles scraped: {new_articles_count}')
         return articles_list
 
+    def scrape_feed(self, source, url, now=None, seen_urls=None, deadline=None):
+        """Scrape one RSS feed of ``source``.
+
+        Returns the articles of the feed that are recent enough, cached or new,
+        how many of them were downloaded, and the poll to record in the feed
+        schedule: (new entries, total entries, timestamp), or None if the feed
+        was not fully polled. ``seen_urls`` is shared between the feeds of a
+        run to skip stories listed in several feeds. No article download is
+        started after the ``deadline`` timestamp.
+        """
+        now = now or datetime.now(timezone.utc)
+        seen_urls = seen_urls if seen_urls is not None else set()
+        max_age = timedelta(days=self.days)
+        articles_list = []
+        new_articles_count = 0
+        new_entries_count = 0
+        out_of_budget = False
+
+        logging.info(f'Processing RSS feed: {url}')
+        if self.guard is not None and not self.guard.allow(url):
+            logging.warning(f'Skipping RSS feed of a failing host: {url}')
+            return articles_list, new_articles_count, None
+        try:
+            d = fetch_feed(url)
+        except Exception as e:
+            logging.error(f'Error parsing RSS feed {url}: {e}')
+            if self.guard is not None:
+                self.guard.record_failure(url, e, remember_url=False)
+            return articles_list, new_articles_count, None
+        if self.guard is not None:
+            self.guard.record_success(url)
+        
+        for entry in d.entries:
+            if not hasattr(entry, 'published'):
+                logging.warning(f'Entry missing "published" attribute: {entry}')
+                continue
+
+            # Resolving a feed-proxy link is a request of its own, guarded like downloads
+            if self.canonicalizer is not None and self.canonicalizer.needs_request(entry.link):
+                if deadline is not None and time.time() > deadline:
+                    logging.warning(f'Scrape budget used up in RSS feed {url}')
+                    out_of_budget = True
+                    break
+                if self.guard is not None and not self.guard.allow(entry.link):
+                    logging.info(f'Skipping link of a failing host or failed recently: {entry.link}')
+                    continue
+                if self.canonicalizer.resolve_redirect(entry.link) is None:
+                    # Without its target the story cannot be told apart from its copies, try again later
+                    if self.guard is not None:
+                        self.guard.record_failure(entry.link, 'redirect not resolved')
+                    continue
+                if self.guard is not None:
+                    self.guard.record_success(entry.link)
+
+            # Tracking parameters and url variants must not make a story look new
+            link = self.canonicalizer.canonicalize(entry.link) if self.canonicalizer is not None else entry.link
+
+            # The same story is often listed in several feeds of a source
+            if link in seen_urls:
+                continue
+            seen_urls.add(link)
+
+            # Cached articles already carry their date, so skip parsing the feed's
+            cached_article = self.cache_manager.get_article(link)
+            if cached_article:
+                try:
+                    article_date = cached_article_date(cached_article)
+                except (KeyError, ValueError):
+                    article_date = None
+                if article_date is not None and now - article_date <= max_age:
+                    logging.debug(f'Using cached article: {link}')
+                    articles_list.append(cached_article)
+                continue
+
+            try:
+                article_date = parse_entry_date(entry)
+                logging.debug(f'Found article with date: {article_date}')
+            except Exception as e:
+                logging.error(f'Error parsing article date: {e}')
+                continue
+            
+            if now - article_date > max_age:
+                continue
+            new_entries_count += 1
+
+            if deadline is not None and time.time() > deadline:
+                logging.warning(f'Scrape budget used up in RSS feed {url}')
+                out_of_budget = True
+                break
+
+            # Skip failing hosts and urls without waiting for their timeouts again
+            if self.guard is not None and not self.guard.allow(entry.link):
+                logging.info(f'Skipping article of a failing host or failed recently: {entry.link}')
+                continue
+
+            # Another worker may already be downloading this article
+            if not self.cache_manager.claim_url(link):
+                logging.debug(f'Article claimed by another worker: {link}')
+                continue
+
+            try:
+                logging.info(f'Processing article: {link}')
+                # Download the link as published, the canonical url is only a key
+                content = Article(entry.link, config=config)
+                content.download()
+                if content.download_state != ArticleDownloadState.SUCCESS:
+                    logging.error(f'Error downloading article {entry.link}: {content.download_exception_msg}')
+                    if self.guard is not None:
+                        self.guard.record_failure(entry.link, content.download_exception_msg)
+                    continue
+                if self.guard is not None:
+                    self.guard.record_success(entry.link)
+                content.parse()
+                try:
+                    # Reposts and url variants share their body, analyze it only once
+                    nlp = self.analysis_cache.get(NLP_VERSION, content.text) if self.analysis_cache is not None else None
+                    if nlp is None:
+                        content.nlp()
+                        nlp = {'keywords': content.keywords, 'summary': content.summary}
+                        if self.analysis_cache is not None:
+                            self.analysis_cache.put(NLP_VERSION, content.text, nlp)
+                    # Sentiment is scored for the whole batch by process_articles
+                    article = {
+                        'source': source,
+                        'url': entry.link,
+                        'canonical_url': link,
+                        'date': article_date.strftime('%Y-%m-%d'),
+                        'time': article_date.strftime('%H:%M:%S %Z'),
+                        'title': content.title,
+                        'body': content.text,
+                        'summary': nlp['summary'],
+                        'keywords': nlp['keywords'],
+                        'image_url': content.top_image,
+                    }
+                    
+                    articles_list.append(article)
+                    self.cache_manager.add_article(link, article)
+                    new_articles_count += 1
+
+                    # Store the thumbnail now so the UI never hotlinks the full image
+                    if self.image_cache is not None and content.top_image:
+                        self.prefetch_image(content.top_image, deadline)
+                except Exception as e:
+                    logging.error(f'Error processing article: {e}')
+                    logging.info('Continuing...')
+            except Exception as e:
+                logging.error(f'Error downloading/parsing article: {e}')
+                logging.info('Continuing...')
+
+        # A feed cut short by the budget stays due, so its remaining entries are fetched next run
+        poll = None if out_of_budget else (new_entries_count, len(d.entries), now.timestamp())
+        return articles_list, new_articles_count, poll
+
+    def prefetch_image(self, image_url, deadline=None):
+        """Store the thumbnail of ``image_url``; pages fetch the ones skipped here when they show them."""
+        if self.image_cache.thumbnail_path(image_url):
+            return
+        if deadline is not None and time.time() > deadline:
+            logging.info(f'Scrape budget used up, leaving image to the pages: {image_url}')
+            return
+        if self.guard is not None and not self.guard.allow(image_url):
+            logging.info(f'Skipping image of a failing host or failed recently: {image_url}')
+            return
+        if self.image_cache.fetch(image_url) is None:
+            if self.guard is not None:
+                self.guard.record_failure(image_url, 'image not fetched')
+        elif self.guard is not None:
+            self.guard.record_success(image_url)
+
 def clean_articles(news_df):
     news_df['clean_body'] = news_df['body'].str.lower()
     stop_words = set(stopwords.words('english'))
@@ -155,24 +386,49 @@ def clean_articles(news_df):
 
     return news_df
 
-def sentiment_analysis(articles):
+def sentiment_analysis(articles, analysis_cache=None, backend=None):
     logging.info("Performing sentiment analysis")
     
     articles_df = pd.DataFrame(articles)
-    articles_df['sentiment'] = articles_df['body'].apply(lambda x: TextBlob(x).sentiment.polarity)
-    
-    def classify_sentiment(polarity):
-        if polarity > 0:
-            return 'positive'
-        elif polarity == 0:
-            return 'neutral'
-        else:
-            return 'negative'
+    backend = backend or get_sentiment_backend()
+    clean_bodies = articles_df['clean_body'].tolist() if 'clean_body' in articles_df.columns else None
+    articles_df['sentiment'] = cached_sentiment(articles_df['body'].tolist(), clean_bodies, backend, analysis_cache)
     
     articles_df['sentiment_category'] = articles_df['sentiment'].apply(classify_sentiment)
     
     return articles_df[['url', 'sentiment', 'sentiment_category']]
 
+def process_articles(articles, cache_manager, analysis_cache=None):
+    """Clean and analyze scraped articles, store them in the cache and index them."""
+    logging.info(f'{len(articles)} articles scraped.')
+    news_df = pd.DataFrame(articles)
+    news_df = clean_articles(news_df)
+    
+    analysis_cache = analysis_cache if analysis_cache is not None else AnalysisCache()
+    sentiment_df = sentiment_analysis(news_df, analysis_cache)
+    analysis_cache.save_cache()
+    
+    news_df.drop(columns=['sentiment', 'sentiment_category'], inplace=True, errors='ignore')
+
+    news_df = pd.merge(news_df, sentiment_df[['url', 'sentiment', 'sentiment_category']], on='url')
+    
+    # Keep the dashboard rollups in step with the cache; cached articles, scored
+    # or cached unscored by the scraper, are already counted and get replaced
+    records = news_df.to_dict(orient='records')
+    rollups = cache_manager.article_rollups()
+    previous = (cache_manager.get_article(cache_key(article)) for article in records)
+    rollups.update(records, [article for article in previous if article])
+
+    # Save cleaned and analyzed articles to cache
+    cache_manager.add_articles(records)
+    rollups.save()
+
+    # Index new articles for "more like this" lookups
+    related_index = RelatedArticlesIndex()
+    if related_index.add(news_df['url'], news_df['title'], news_df['clean_body']):
+        related_index.save()
+    return news_df
+
 # Custom configuration for the newspaper library
 config = Config()
 config.fetch_images = False
@@ -198,12 +454,19 @@ if __name__ == '__main__':
     days_to_scrape = int(os.getenv('DAYS_TO_SCRAPE', 7))
     
     cache_manager = CacheManager()
+    canonicalizer = UrlCanonicalizer()
+    # Merge entries cached before their urls were canonical, from memoized redirects only
+    migrate_cache(cache_manager, UrlCanonicalizer(resolve=False), RelatedArticlesIndex(), MetricRollups())
     
     scraper_done = False  # Flag to indicate when scraping is done
     blinking_thread = threading.Thread(target=show_blinking_message)
     blinking_thread.start()
     
-    scraper = Scraper(sources, days_to_scrape, cache_manager)
+    image_cache = ImageCache() if os.getenv('PREFETCH_IMAGES', '1') == '1' else None
+    schedule = FeedSchedule() if os.getenv('ADAPTIVE_POLLING', '1') == '1' else None
+    analysis_cache = AnalysisCache()
+    scraper = Scraper(sources, days_to_scrape, cache_manager, image_cache, schedule, analysis_cache, canonicalizer,
+                      FetchGuard(), SCRAPE_BUDGET_SECONDS)
     try:
         articles = scraper.scrape()
         scraper_done = True  # Set flag to True to stop the blinking message
@@ -211,19 +474,7 @@ if __name__ == '__main__':
         if not articles:
             logging.warning('No articles were scraped.')
         else:
-            logging.info(f'{len(articles)} articles scraped.')
-            news_df = pd.DataFrame(articles)
-            news_df = clean_articles(news_df)
-            
-            sentiment_df = sentiment_analysis(articles)
-            
-            news_df.drop(columns=['sentiment', 'sentiment_category'], inplace=True, errors='ignore')
-
-            news_df = pd.merge(news_df, sentiment_df[['url', 'sentiment', 'sentiment_category']], on='url')
-            
-            # Save cleaned and analyzed articles to cache
-            for article in news_df.to_dict(orient='records'):
-                cache_manager.add_article(article['url'], article)
+            process_articles(articles, cache_manager, analysis_cache)
             
     except Exception as e:
         logging.error(f'An error occurred: {e}')
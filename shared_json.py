@@ -0,0 +1,38 @@
+"""JSON state files shared by the processes of a scrape.
+
+Scrapers and distributed workers each keep their own copy of
+files such as the analysis cache and only add to it. ``update_json``
+merges those additions into the file under an exclusive lock, so
+concurrent saves do not drop each other's entries.
+"""
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+
+@contextmanager
+def locked(path):
+    """Hold the lock on the file at ``path`` shared with other processes."""
+    with open(f'{path}.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def update_json(path, update, default, indent=None):
+    """Apply ``update`` to the data on disk, or to ``default`` if there is none, and save it.
+
+    ``update`` changes the data in place. Returns the saved data.
+    """
+    with locked(path):
+        data = default
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                data = json.load(f)
+        update(data)
+        tmp_file = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f, indent=indent)
+        os.replace(tmp_file, path)
+    return data
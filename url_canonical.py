@@ -0,0 +1,189 @@
+"""Canonical article urls, so one story is cached, analyzed and clustered once.
+
+Running this module merges cache entries that are duplicates under the
+canonical form:
+
+    python url_canonical.py
+"""
+import json
+import logging
+import os
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import requests
+from shared_json import update_json
+
+REDIRECTS_FILE = 'url_redirects.json'
+RESOLVE_TIMEOUT = 10
+USER_AGENT = 'Mozilla/5.0 (compatible; GikiNews/1.0)'
+
+# Query parameters that only record where a click came from
+TRACKING_PARAMS = {
+    'cmpid', 'dclid', 'fbclid', 'gclid', 'icid', 'mc_cid', 'mc_eid', 'mod', 'msclkid', 'ocid',
+    'ref', 'siteid', 'smid', 'taid', 'yptr', '__source',
+}
+TRACKING_PREFIXES = ('utm_', 'at_', 'xtor')
+
+# Per-domain rules, looked up from the most specific host suffix:
+#   drop_query        the site never needs a query string to identify an article
+#   resolve_redirects links are feed proxies, the article url is where they redirect
+#   host              serve the same articles under one host
+DOMAIN_RULES = {
+    'cnn.com': {'drop_query': True},
+    'edition.cnn.com': {'drop_query': True, 'host': 'www.cnn.com'},
+    'us.cnn.com': {'drop_query': True, 'host': 'www.cnn.com'},
+    'rss.cnn.com': {'resolve_redirects': True},
+    'cnbc.com': {'drop_query': True},
+    'nytimes.com': {'drop_query': True},
+    'theguardian.com': {'drop_query': True},
+    'bbc.co.uk': {'drop_query': True},
+    'bbc.com': {'drop_query': True},
+    'ft.com': {'drop_query': True},
+    'wsj.com': {'drop_query': True},
+    'marketwatch.com': {'drop_query': True},
+    'fortune.com': {'drop_query': True},
+    'finance.yahoo.com': {'drop_query': True},
+    'reuters.com': {'drop_query': True},
+    'feeds.reuters.com': {'resolve_redirects': True},
+    'feedproxy.google.com': {'resolve_redirects': True},
+    'feeds.feedburner.com': {'resolve_redirects': True},
+}
+
+def domain_rule(host, rules=DOMAIN_RULES):
+    parts = host.split('.')
+    for i in range(len(parts) - 1):
+        rule = rules.get('.'.join(parts[i:]))
+        if rule is not None:
+            return rule
+    return {}
+
+def canonical_url(url, rules=DOMAIN_RULES):
+    """Apply the rewrite rules to ``url``, without any network access.
+
+    The scheme is always https, the host lowercase without a default port,
+    tracking parameters, fragments and trailing slashes are dropped and the
+    remaining query parameters are sorted.
+    """
+    parts = urlsplit(url.strip())
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return url
+    host = parts.hostname
+    rule = domain_rule(host, rules)
+    host = rule.get('host', host)
+    if parts.port and parts.port not in (80, 443):
+        host = f'{host}:{parts.port}'
+
+    path = parts.path.rstrip('/') or '/'
+    query = ''
+    if not rule.get('drop_query'):
+        params = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                  if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)]
+        query = urlencode(sorted(params))
+    return urlunsplit(('https', host, path, query, ''))
+
+class UrlCanonicalizer:
+    """Canonical urls, following feed-proxy redirects once per link.
+
+    Resolved redirects are memoized in ``url_redirects.json``. With
+    ``resolve=False`` only the memo is used, which keeps migrations
+    offline.
+    """
+
+    def __init__(self, redirects_file=REDIRECTS_FILE, rules=DOMAIN_RULES, resolve=True):
+        self.redirects_file = redirects_file
+        self.rules = rules
+        self.resolve = resolve
+        self.new_redirects = {}
+        self.load_redirects()
+
+    def load_redirects(self):
+        if os.path.exists(self.redirects_file):
+            with open(self.redirects_file, 'r') as f:
+                self.redirects = json.load(f)
+        else:
+            self.redirects = {}
+
+    def save_redirects(self):
+        if not self.new_redirects:
+            return
+        logging.info(f'Saving {len(self.new_redirects)} resolved redirects')
+        self.redirects = update_json(self.redirects_file, lambda redirects: redirects.update(self.new_redirects), {},
+                                     indent=4)
+        self.new_redirects = {}
+
+    def canonicalize(self, url):
+        if self.follows_redirects(url):
+            url = self.resolve_redirect(url) or url
+        return canonical_url(url, self.rules)
+
+    def follows_redirects(self, url):
+        return bool(domain_rule((urlsplit(url).hostname or '').lower(), self.rules).get('resolve_redirects'))
+
+    def needs_request(self, url):
+        """Whether canonicalizing ``url`` has to request it because its redirect is not memoized yet."""
+        return (self.resolve and url not in self.new_redirects and url not in self.redirects
+                and self.follows_redirects(url))
+
+    def resolve_redirect(self, url):
+        """Final url after following the redirects of ``url``, or None if it cannot be resolved."""
+        target = self.new_redirects.get(url) or self.redirects.get(url)
+        if target or not self.resolve:
+            return target
+        try:
+            response = requests.head(url, allow_redirects=True, timeout=RESOLVE_TIMEOUT,
+                                     headers={'User-Agent': USER_AGENT})
+            if response.status_code >= 400:
+                # Some servers refuse HEAD, fetch only the headers of a GET instead
+                response = requests.get(url, allow_redirects=True, timeout=RESOLVE_TIMEOUT, stream=True,
+                                        headers={'User-Agent': USER_AGENT})
+                response.close()
+            response.raise_for_status()
+        except Exception as e:
+            logging.error(f'Error resolving redirect {url}: {e}')
+            return None
+        self.new_redirects[url] = response.url
+        return response.url
+
+def migrate_cache(cache_manager, canonicalizer, related_index=None, rollups=None):
+    """Re-key the article cache by canonical url, merging duplicate entries.
+
+    Of each group of duplicates the processed entry with the longest body is
+    kept, with its published ``url`` and the key as ``canonical_url``.
+    Returns the number of entries removed.
+    """
+    canonical_keys = {key: canonicalizer.canonicalize(key) for key in cache_manager.cache}
+    groups = {}
+    for key, canonical in canonical_keys.items():
+        groups.setdefault(canonical, []).append(cache_manager.cache[key])
+
+    cache = {}
+    # Published urls of the merged duplicates, mapped to the url of the entry kept in their place
+    merged = {}
+    for canonical, articles in groups.items():
+        kept = max(articles, key=lambda article: ('clean_body' in article, len(article.get('body') or '')))
+        cache[canonical] = {**kept, 'canonical_url': canonical}
+        merged.update((article['url'], kept['url']) for article in articles if article['url'] != kept['url'])
+
+    removed = len(cache_manager.cache) - len(cache)
+    if any(key != canonical or cache_manager.cache[key].get('canonical_url') != canonical
+           for key, canonical in canonical_keys.items()):
+        logging.info(f'Migrated article cache to canonical urls, {removed} duplicates merged')
+        cache_manager.cache = cache
+        cache_manager.save_cache()
+        if related_index is not None and related_index.rename(merged):
+            related_index.save()
+        if rollups is not None:
+            rollups.rebuild(cache.values())
+            rollups.save()
+    canonicalizer.save_redirects()
+    return removed
+
+if __name__ == '__main__':
+    from scrapper import CacheManager
+    from related_index import RelatedArticlesIndex
+    from rollups import MetricRollups
+
+    cache_manager = CacheManager()
+    total = len(cache_manager.cache)
+    # Unlike the migration at scraper start, follow redirects not memoized yet
+    removed = migrate_cache(cache_manager, UrlCanonicalizer(), RelatedArticlesIndex(), MetricRollups())
+    print(f'{total} cached articles, {removed} duplicates merged')
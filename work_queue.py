@@ -0,0 +1,156 @@
+import json
+import logging
+import sqlite3
+import time
+
+QUEUE_FILE = 'scrape_queue.sqlite'
+LEASE_SECONDS = 30 * 60
+MAX_ATTEMPTS = 3
+
+class WorkQueue:
+    """SQLite work queue shared by the processes of a distributed scrape.
+
+    The coordinator enqueues one task per RSS feed, in the order feeds should
+    be scraped. Workers lease a feed,
+    scrape it and mark it done; a lease that is not completed in time, for
+    instance because its worker died, makes the feed claimable again.
+    Article urls are claimed with a primary-key insert before downloading,
+    so each article is fetched by exactly one worker, and the scraped
+    articles are stored here until the coordinator collects them.
+    """
+
+    def __init__(self, queue_file=QUEUE_FILE, lease_seconds=LEASE_SECONDS):
+        self.queue_file = queue_file
+        self.lease_seconds = lease_seconds
+        # Autocommit mode, multi-statement updates use explicit transactions
+        self.conn = sqlite3.connect(queue_file, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS feeds (
+                feed_url TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                new_articles INTEGER,
+                new_entries INTEGER,
+                total_entries INTEGER,
+                polled_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS claims (
+                url TEXT PRIMARY KEY,
+                worker TEXT NOT NULL,
+                claimed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS articles (
+                url TEXT PRIMARY KEY,
+                worker TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+        """)
+        # Queue files created before polls were stored lack their columns
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(feeds)')}
+        for column, kind in (('new_entries', 'INTEGER'), ('total_entries', 'INTEGER'), ('polled_at', 'REAL')):
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE feeds ADD COLUMN {column} {kind}')
+
+    def close(self):
+        self.conn.close()
+
+    def enqueue(self, feeds):
+        """Start a new run with one pending task per (source, feed url) pair in ``feeds``."""
+        with self._transaction():
+            self.conn.execute('DELETE FROM feeds')
+            self.conn.execute('DELETE FROM claims')
+            self.conn.execute('DELETE FROM articles')
+            self.conn.executemany('INSERT OR IGNORE INTO feeds (feed_url, source) VALUES (?, ?)',
+                                  [(url, source) for source, url in feeds])
+        logging.info(f'Enqueued {self.progress().get("pending", 0)} feeds')
+
+    def claim_feed(self, worker):
+        """Lease the next pending or expired feed to ``worker``; returns (source, feed_url) or None."""
+        now = time.time()
+        with self._transaction():
+            row = self.conn.execute("""
+                SELECT feed_url, source FROM feeds
+                WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) AND attempts < ?
+                ORDER BY rowid LIMIT 1
+            """, (now, MAX_ATTEMPTS)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("""
+                UPDATE feeds SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1
+                WHERE feed_url = ?
+            """, (worker, now + self.lease_seconds, row[0]))
+        return row[1], row[0]
+
+    def complete_feed(self, feed_url, worker, new_articles, poll=None):
+        """Mark a feed done; ``poll`` is (new entries, total entries, timestamp) if it was fully polled."""
+        new_entries, total_entries, polled_at = poll if poll is not None else (None, None, None)
+        self.conn.execute("""
+            UPDATE feeds SET status = 'done', new_articles = ?, new_entries = ?, total_entries = ?, polled_at = ?
+            WHERE feed_url = ? AND worker = ?
+        """, (new_articles, new_entries, total_entries, polled_at, feed_url, worker))
+
+    def release_feed(self, feed_url, worker):
+        """Give a feed back after a failure so it can be retried, up to MAX_ATTEMPTS."""
+        self.conn.execute("UPDATE feeds SET status = 'pending', worker = NULL WHERE feed_url = ? AND worker = ?",
+                          (feed_url, worker))
+
+    def claim_url(self, url, worker):
+        """Return True if ``worker`` may download ``url``.
+
+        Claims of articles that were never stored expire with the feed lease,
+        so a url claimed by a dead worker is picked up again.
+        """
+        now = time.time()
+        cursor = self.conn.execute("""
+            INSERT INTO claims (url, worker, claimed_at) VALUES (?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET worker = excluded.worker, claimed_at = excluded.claimed_at
+            WHERE claims.claimed_at < ? AND claims.url NOT IN (SELECT url FROM articles)
+        """, (url, worker, now, now - self.lease_seconds))
+        return cursor.rowcount == 1
+
+    def add_article(self, url, article, worker):
+        self.conn.execute('INSERT OR REPLACE INTO articles (url, worker, data) VALUES (?, ?, ?)',
+                          (url, worker, json.dumps(article)))
+
+    def get_article(self, url):
+        row = self.conn.execute('SELECT data FROM articles WHERE url = ?', (url,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def articles(self):
+        return [json.loads(data) for data, in self.conn.execute('SELECT data FROM articles ORDER BY rowid')]
+
+    def progress(self):
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM feeds GROUP BY status').fetchall())
+
+    def polled_feeds(self):
+        """The (feed_url, new_entries, total_entries, polled_at) of the feeds that were fully polled."""
+        return self.conn.execute("""
+            SELECT feed_url, new_entries, total_entries, polled_at FROM feeds
+            WHERE status = 'done' AND polled_at IS NOT NULL
+        """).fetchall()
+
+    def worker_stats(self):
+        return self.conn.execute("""
+            SELECT worker, COUNT(*), SUM(new_articles) FROM feeds WHERE status = 'done' GROUP BY worker ORDER BY worker
+        """).fetchall()
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the write lock up front, so two workers can never
+    # select the same pending feed before one of them marks it leased
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False